@@ -0,0 +1,144 @@
+"""Benchmark CoreNLP XML to SAF conversion on large documents.
+
+Compares xtas.tasks._corenlp.stanford_to_saf against the previous,
+corenlp_xml-based converter (reproduced below; needs corenlp_xml to be
+installed) on synthetic CoreNLP output, and checks that both produce the
+same SAF.
+
+Usage: python benchmarks/bench_stanford_to_saf.py [n_sentences ...]
+"""
+
+from __future__ import print_function
+
+import collections
+import gc
+import resource
+import sys
+from timeit import default_timer as timer
+
+from corenlp_xml.document import Document
+from six import iteritems
+
+from xtas.tasks._corenlp import _POSMAP, stanford_to_saf
+
+
+def old_stanford_to_saf(xml_bytes):
+    """The converter as it was before it switched to iterparse."""
+    doc = Document(xml_bytes)
+    saf = collections.defaultdict(list)
+
+    saf['header'] = {}
+    tokens = {}     # (xml_sentid, xml_tokenid) : saf_tokenid
+
+    def tokenid(sentid, tokenid):
+        if (sentid, tokenid) in tokens:
+            raise ValueError("Duplicate tokenid: {sentid}, {tokenid}"
+                             .format(**locals()))
+        saf_tokenid = len(tokens) + 1
+        tokens[sentid, tokenid] = saf_tokenid
+        return saf_tokenid
+
+    for sent in doc.sentences:
+        saf['tokens'] += [dict(id=tokenid(sent.id, t.id),
+                               sentence=sent.id,
+                               offset=t.character_offset_begin,
+                               lemma=t.lemma, word=t.word,
+                               pos=t.pos, pos1=_POSMAP[t.pos])
+                          for t in sent.tokens]
+
+        saf['entities'] += [{'tokens': [tokens[sent.id, t.id]], 'type': t.ner}
+                            for t in sent.tokens if t.ner not in (None, 'O')]
+
+        if sent.collapsed_ccprocessed_dependencies:
+            links = sent.collapsed_ccprocessed_dependencies.links
+            saf['dependencies'] += [{'child': tokens[sent.id,
+                                                     dep.dependent.idx],
+                                     'parent': tokens[sent.id,
+                                                      dep.governor.idx],
+                                     'relation': dep.type}
+                                    for dep in links if dep.type != 'root']
+
+    if doc.coreferences:
+        saf['coreferences'] = [[[tokens[m.sentence.id, t.id] for t in m.tokens]
+                                for m in coref.mentions]
+                               for coref in doc.coreferences]
+    saf['trees'] = [{'sentence': s.id, 'tree': s.parse_string.strip()}
+                    for s in doc.sentences if s.parse_string is not None]
+
+    return {k: v for (k, v) in iteritems(saf) if v != []}
+
+
+_WORDS = [("John", "John", "NNP", "PERSON"), ("saw", "see", "VBD", "O"),
+          ("him", "he", "PRP", "O"), ("in", "in", "IN", "O"),
+          ("London", "London", "NNP", "LOCATION"), (".", ".", ".", "O")]
+_DEPS = [("root", 0, 2), ("nsubj", 2, 1), ("dobj", 2, 3),
+         ("prep_in", 2, 5)]
+
+
+def make_xml(n_sentences):
+    """Synthetic CoreNLP output with n_sentences sentences."""
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<root>\n<document>\n'
+           '<sentences>\n']
+    offset = 0
+    for sid in range(1, n_sentences + 1):
+        out.append('<sentence id="%d">\n<tokens>\n' % sid)
+        for tid, (word, lemma, pos, ner) in enumerate(_WORDS, 1):
+            out.append('<token id="%d"><word>%s</word><lemma>%s</lemma>'
+                       '<CharacterOffsetBegin>%d</CharacterOffsetBegin>'
+                       '<CharacterOffsetEnd>%d</CharacterOffsetEnd>'
+                       '<POS>%s</POS><NER>%s</NER></token>\n'
+                       % (tid, word, lemma, offset, offset + len(word),
+                          pos, ner))
+            offset += len(word) + 1
+        out.append('</tokens>\n<parse>(ROOT (S (NP (NNP John)) (VP (VBD saw) '
+                   '(NP (PRP him)) (PP (IN in) (NP (NNP London)))) (. .))) '
+                   '</parse>\n')
+        for typ in ['basic-dependencies', 'collapsed-dependencies',
+                    'collapsed-ccprocessed-dependencies']:
+            out.append('<dependencies type="%s">\n' % typ)
+            for rel, gov, dep in _DEPS:
+                out.append('<dep type="%s"><governor idx="%d">x</governor>'
+                           '<dependent idx="%d">y</dependent></dep>\n'
+                           % (rel, gov, dep))
+            out.append('</dependencies>\n')
+        out.append('</sentence>\n')
+    out.append('</sentences>\n<coreference>\n')
+    for sid in range(1, n_sentences, 2):
+        out.append('<coreference>\n')
+        for s, start in [(sid, 1), (sid + 1, 3)]:
+            out.append('<mention><sentence>%d</sentence><start>%d</start>'
+                       '<end>%d</end><head>%d</head></mention>\n'
+                       % (s, start, start + 1, start))
+        out.append('</coreference>\n')
+    out.append('</coreference>\n</document>\n</root>\n')
+    return ''.join(out)
+
+
+def normalize(saf):
+    saf = dict(saf)
+    del saf['header']
+    # The old converter grouped dependencies by relation type.
+    saf['dependencies'] = sorted(saf['dependencies'])
+    return saf
+
+
+def bench(n_sentences):
+    xml = make_xml(n_sentences)
+    results = {}
+    for name, convert in [("corenlp_xml", old_stanford_to_saf),
+                          ("iterparse", stanford_to_saf)]:
+        gc.collect()
+        t0 = timer()
+        results[name] = convert(xml)
+        t = timer() - t0
+        print("%8d sentences, %6.1f MB XML, %-12s %7.3f s"
+              % (n_sentences, len(xml) / 2. ** 20, name, t))
+    assert normalize(results["corenlp_xml"]) == normalize(results["iterparse"])
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+    for n in sizes:
+        bench(n)
+    print("Peak RSS: %.1f MB"
+          % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
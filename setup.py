@@ -44,7 +44,9 @@ setup(
     long_description=readme(),
     author="Netherlands eScience Center",
     packages=["xtas", "xtas.tasks", "xtas.tests", "xtas.webserver"],
-    package_data={"xtas.tasks": ["*.txt", "*.xml", "NERServer.class"]},
+    package_data={"xtas.tasks": ["*.txt", "*.xml", "NERServer.class",
+                                 "HeidelTimeServer.class",
+                                 "HeidelTimeServer.java"]},
     url="https://github.com/NLeSC/xtas",
     version=__version__,
     classifiers=[
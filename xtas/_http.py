@@ -0,0 +1,212 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP connections and response cache shared by the web service tasks.
+
+Connections are kept alive and reused across tasks in the same worker
+process. Responses are cached in memory, keyed on the service, language,
+a hash of the text and the other parameters of the call, so running a task
+again on an unchanged document does not hit the service.
+
+Configured through environment variables:
+
+XTAS_HTTP_POOL_SIZE
+    Number of connections kept open per host (default 10).
+XTAS_HTTP_TIMEOUT
+    Timeout in seconds for connecting and for reading responses (default:
+    no timeout).
+XTAS_HTTP_CACHE_SIZE
+    Maximum number of cached responses (default 1000; 0 disables caching).
+XTAS_HTTP_MAX_CONCURRENT
+    Maximum number of concurrent requests per service (default 8).
+XTAS_HTTP_RETRIES
+    Number of times a request is retried after a connection error or a
+    server error (default 3), waiting XTAS_HTTP_BACKOFF seconds (default
+    .5) before the first retry and twice as long before every next one.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+from urllib import urlencode
+
+import urllib3
+
+
+class HTTPError(IOError):
+    """Raised when a web service returns an error status."""
+
+    def __init__(self, status, url, body):
+        super(HTTPError, self).__init__("HTTP status %d from %s: %r"
+                                        % (status, url, body[:200]))
+        self.status = status
+        self.url = url
+
+
+_POOL_SIZE = int(os.environ.get('XTAS_HTTP_POOL_SIZE', 10))
+_TIMEOUT = os.environ.get('XTAS_HTTP_TIMEOUT')
+_CACHE_SIZE = int(os.environ.get('XTAS_HTTP_CACHE_SIZE', 1000))
+_MAX_CONCURRENT = int(os.environ.get('XTAS_HTTP_MAX_CONCURRENT', 8))
+_RETRIES = int(os.environ.get('XTAS_HTTP_RETRIES', 3))
+_BACKOFF = float(os.environ.get('XTAS_HTTP_BACKOFF', .5))
+
+# Query strings longer than this are sent as POST bodies instead.
+_MAX_QUERY = 2000
+
+_http = urllib3.PoolManager(
+    maxsize=_POOL_SIZE,
+    timeout=urllib3.Timeout(total=None if _TIMEOUT is None
+                            else float(_TIMEOUT)),
+    # Follow redirects like urllib2 did, but leave retrying to the caller.
+    retries=urllib3.Retry(total=None, connect=0, read=0, status=0,
+                          redirect=5, raise_on_status=False))
+
+
+def request(method, url, fields=None, body=None, headers=None):
+    """Send an HTTP request over the shared connections.
+
+    fields are sent form-encoded in the body; otherwise body is sent as-is.
+    Returns the response body. Raises HTTPError for error statuses.
+    """
+    if fields is not None:
+        body = urlencode(_encode_fields(fields))
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    response = _http.urlopen(method, url, body=body, headers=headers)
+    if response.status >= 400:
+        raise HTTPError(response.status, url, response.data)
+    return response.data
+
+
+def form_request(url, fields, headers=None):
+    """GET url with fields in the query string, or POST them if too long."""
+    query = urlencode(_encode_fields(fields))
+    if len(query) <= _MAX_QUERY:
+        return request('GET', '%s?%s' % (url, query), headers=headers)
+    return request('POST', url, fields=fields, headers=headers)
+
+
+def _encode_fields(fields):
+    return [(k, v.encode('utf-8') if isinstance(v, unicode) else v)
+            for k, v in sorted(fields.items())]
+
+
+class LRUCache(object):
+    """Thread-safe mapping that holds at most size items.
+
+    When full, the least recently used item is evicted.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_cache = LRUCache(_CACHE_SIZE)
+
+_semaphores = {}    # service : BoundedSemaphore
+_semaphores_lock = threading.Lock()
+
+
+def _semaphore(service):
+    with _semaphores_lock:
+        if service not in _semaphores:
+            _semaphores[service] = threading.BoundedSemaphore(_MAX_CONCURRENT)
+        return _semaphores[service]
+
+
+def _retryable(e):
+    if isinstance(e, HTTPError):
+        return e.status >= 500 or e.status == 429
+    # Connection errors, timeouts, broken responses.
+    return isinstance(e, urllib3.exceptions.HTTPError)
+
+
+def with_retries(send):
+    """Call send, retrying with exponential backoff on transient errors."""
+    for attempt in range(_RETRIES + 1):
+        try:
+            return send()
+        except Exception as e:
+            if attempt == _RETRIES or not _retryable(e):
+                raise
+        time.sleep(_BACKOFF * 2 ** attempt)
+
+
+def call_service(service, lang, text, params, send):
+    """Call a web service on text, through the response cache.
+
+    send is called without arguments to do the actual request, and should
+    return the body of the response. Returns the response decoded as JSON.
+    The cache holds raw bodies, so callers get fresh objects that they may
+    modify.
+
+    At most XTAS_HTTP_MAX_CONCURRENT requests per service are made at the
+    same time; transient errors are retried.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    key = (service, lang, hashlib.sha1(text).hexdigest(),
+           tuple(sorted(params.items())))
+    body = _cache.get(key)
+    if body is None:
+        with _semaphore(service):
+            body = with_retries(send)
+        _cache.put(key, body)
+    return json.loads(body)
+
+
+def map_concurrent(func, items):
+    """Apply func to each of items in a pool of threads.
+
+    Returns the results in the order of items. Meant for functions that
+    call web services through call_service, which limits the number of
+    concurrent requests per service.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return map(func, items)
+    pool = ThreadPool(min(len(items), _MAX_CONCURRENT))
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.terminate()
@@ -0,0 +1,142 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pools of expensive objects, such as external processes."""
+
+from contextlib import contextmanager
+import logging
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Pool(object):
+    """Bounded pool of reusable objects.
+
+    Objects are created on demand by calling factory, up to size at a time.
+    When all objects are in use, checkout blocks until one is returned.
+
+    Parameters
+    ----------
+    factory : callable
+        Called without arguments to create a new object. Objects must have
+        a close method.
+    size : int
+        Maximum number of objects.
+    idle_timeout : float, optional
+        Objects that have not been used for this many seconds are closed
+        (and recreated when needed again). By default, objects live forever.
+    """
+
+    def __init__(self, factory, size=1, idle_timeout=None):
+        if size < 1:
+            raise ValueError("pool size should be at least 1, got %r" % size)
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._idle = []         # (time of last use, object), newest last
+        self._n_objects = 0
+        self._reaper = None
+
+    @contextmanager
+    def checkout(self):
+        """Context manager that gets an object from the pool.
+
+        The object is returned to the pool at the end of the with block.
+        """
+        obj = self._acquire()
+        try:
+            yield obj
+        finally:
+            self._release(obj)
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()[1]
+                if self._n_objects < self.size:
+                    self._n_objects += 1
+                    break
+                self._cond.wait()
+
+        try:
+            return self.factory()
+        except:
+            with self._cond:
+                self._n_objects -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, obj):
+        with self._cond:
+            self._idle.append((time.time(), obj))
+            self._cond.notify()
+            if self.idle_timeout is not None and self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap)
+                self._reaper.daemon = True
+                self._reaper.start()
+
+    def _reap(self):
+        """Close idle objects periodically. Runs in a daemon thread."""
+        while True:
+            time.sleep(self.idle_timeout / 2.)
+            deadline = time.time() - self.idle_timeout
+            with self._cond:
+                expired = [obj for t, obj in self._idle if t < deadline]
+                self._idle = [(t, obj) for t, obj in self._idle
+                              if t >= deadline]
+                self._n_objects -= len(expired)
+                self._cond.notify(len(expired))
+            for obj in expired:
+                logger.info("Closing idle %r" % obj)
+                obj.close()
+
+    def close(self):
+        """Close all idle objects."""
+        with self._cond:
+            idle = [obj for _, obj in self._idle]
+            self._idle = []
+            self._n_objects -= len(idle)
+            self._cond.notify(len(idle))
+        for obj in idle:
+            obj.close()
+
+
+_UNITS = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+
+def parse_memory(spec):
+    """Parse a Java-style memory size such as "3G" or "512m" into bytes."""
+    m = re.match(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', str(spec), re.I)
+    if m is None:
+        raise ValueError("invalid memory size %r" % spec)
+    return int(m.group(1)) * _UNITS[m.group(2).lower()]
+
+
+def pool_size(size=None, memory_budget=None, memory=None):
+    """Determine a pool size.
+
+    Returns size if given, else the number of processes of the given memory
+    size that fit in memory_budget, else 1.
+    """
+    if size:
+        return int(size)
+    if memory_budget and memory:
+        return max(1, parse_memory(memory_budget) // parse_memory(memory))
+    return 1
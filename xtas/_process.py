@@ -0,0 +1,355 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long-running external processes (parsers, taggers) and pools of them.
+
+External tools are wrapped by subclassing ManagedProcess and implementing
+their protocol in communicate. The base class takes care of starting the
+process, restarting it when it dies, recycling it after a number of
+requests, killing it when a request takes too long, and keeping metrics.
+
+Pools of processes are configured through environment variables named
+after the tool, e.g. for Alpino:
+
+XTAS_ALPINO_POOL_SIZE
+    Number of processes per worker process (default 1).
+XTAS_ALPINO_MEMORY
+    Alternatively, the total memory the processes may use (e.g. "12G");
+    only for tools that declare how much memory a process needs.
+XTAS_ALPINO_IDLE_TIMEOUT
+    Stop processes that have been idle for this many seconds.
+XTAS_ALPINO_MAX_REQUESTS
+    Restart a process after it has handled this many requests.
+XTAS_ALPINO_TIMEOUT
+    Maximum number of seconds per document. A process that takes longer is
+    killed (and restarted for the next request), and the request fails with
+    ProcessTimeout.
+XTAS_ALPINO_START_TIMEOUT
+    Maximum number of seconds for a process to start up.
+"""
+
+import collections
+import errno
+from functools import partial
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+from ._pool import Pool, pool_size
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessDied(Exception):
+    """Raised when an external process exits or closes its output."""
+
+
+class ProcessTimeout(Exception):
+    """Raised when an external process does not answer in time."""
+
+
+class ManagedProcess(object):
+    """Base class for wrappers around a long-running external process.
+
+    Subclasses implement command, which returns the command to run, and
+    communicate, which sends a request to self.process and returns the
+    answer, raising ProcessDied (see died) when the process goes away.
+    They may implement handshake, to wait for the process to get ready
+    after starting it, probe, to check its health before a request, and
+    size, to tell how many documents a request contains.
+
+    Requests are made through request, which (re)starts the process as
+    needed and retries once when it dies while handling a request.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Maximum number of seconds per document in a request. When it
+        expires, the process is killed and ProcessTimeout is raised.
+    max_requests : int, optional
+        Restart the process after it has handled this many requests.
+    start_timeout : float, optional
+        Maximum number of seconds for the handshake.
+    """
+
+    # Name of the tool, for log messages and metrics.
+    name = "process"
+    # Run command through the shell.
+    shell = False
+    # Read stderr in a background thread, keeping the last lines for
+    # error messages. Subclasses that read stderr themselves set this to
+    # False.
+    drain_stderr = True
+    # Working directory and environment of the process.
+    cwd = None
+    env = None
+
+    def __init__(self, timeout=None, max_requests=None, start_timeout=None):
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.start_timeout = start_timeout
+        self.process = None
+        self._lock = threading.RLock()
+        self.start()
+
+    def command(self):
+        """Command to run, as a list or (if shell is set) a string."""
+        raise NotImplementedError()
+
+    def handshake(self):
+        """Wait for a freshly started process to get ready."""
+
+    def probe(self):
+        """Health check, done before every request."""
+        return self.process.poll() is None
+
+    def communicate(self, *args, **kwargs):
+        """Send a request to the process and return its answer."""
+        raise NotImplementedError()
+
+    def size(self, *args, **kwargs):
+        """Number of documents in a request, for the timeout."""
+        return 1
+
+    def start(self):
+        cmd = self.command()
+        logger.info("Starting %s: %r" % (self.name, cmd))
+        # A new session, so that we can kill any children as well.
+        self.process = subprocess.Popen(cmd, shell=self.shell,
+                                        cwd=self.cwd, env=self.env,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        preexec_fn=os.setsid)
+        self.n_requests = 0
+        self._stderr = collections.deque(maxlen=_STDERR_LINES)
+        if self.drain_stderr:
+            reader = threading.Thread(target=_drain,
+                                      args=(self.process.stderr,
+                                            self._stderr))
+            reader.daemon = True
+            reader.start()
+        _count(self.name, 'started')
+        try:
+            self._with_timeout(self.start_timeout, self.handshake)
+        except:
+            self.close()
+            raise
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def request(self, *args, **kwargs):
+        """Call communicate, restarting the process if needed."""
+        with self._lock:
+            if self.max_requests and self.n_requests >= self.max_requests:
+                logger.info("Recycling %s after %d requests"
+                            % (self.name, self.n_requests))
+                _count(self.name, 'recycled')
+                self.restart()
+            elif not self.probe():
+                logger.info("%s process died, restarting" % self.name)
+                self.restart()
+
+            try:
+                return self._request(args, kwargs)
+            except ProcessDied as e:
+                # Retry once, in case the process died before this request.
+                logger.warn("%s; restarting" % e)
+                self.restart()
+                return self._request(args, kwargs)
+
+    def _request(self, args, kwargs):
+        self.n_requests += 1
+        _count(self.name, 'requests')
+        t0 = time.time()
+        timeout = self.timeout
+        if timeout is not None:
+            timeout *= max(1, self.size(*args, **kwargs))
+        try:
+            return self._with_timeout(timeout, self.communicate,
+                                      *args, **kwargs)
+        except:
+            _count(self.name, 'failures')
+            raise
+        finally:
+            _count(self.name, 'seconds', time.time() - t0)
+
+    def _with_timeout(self, timeout, func, *args, **kwargs):
+        """Call func, killing the process if it takes over timeout seconds.
+        """
+        if timeout is None:
+            return func(*args, **kwargs)
+
+        process = self.process
+        expired = []
+
+        def expire():
+            expired.append(True)
+            _kill(process)
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if not expired:
+                raise
+            _count(self.name, 'timeouts')
+            raise ProcessTimeout("%s did not answer within %g seconds; "
+                                 "killed it" % (self.name, timeout))
+        finally:
+            timer.cancel()
+
+    def exchange(self, data, done, on_stdout, on_stderr=None,
+                 idle_timeout=None):
+        """Write data to the process while reading its output.
+
+        Output is passed to on_stdout (and, if given, on_stderr) in chunks
+        as it arrives, until done() returns true. Reading and writing
+        are interleaved, so that neither the process nor we block on a
+        full pipe, however much data is sent.
+
+        idle_timeout, if given, is called once all data is written. When it
+        returns a number of seconds rather than None, we also return if the
+        process produces no output for that long.
+        """
+        proc = self.process
+        handlers = {proc.stdout.fileno(): on_stdout}
+        if on_stderr is not None:
+            handlers[proc.stderr.fileno()] = on_stderr
+        stdin = proc.stdin.fileno()
+        written = 0
+
+        while not done():
+            writing = [stdin] if written < len(data) else []
+            wait = None
+            if idle_timeout is not None and not writing:
+                wait = idle_timeout()
+            readable, writable, _ = select.select(list(handlers), writing, [],
+                                                  wait)
+            if not readable and not writable:
+                return
+            if writable:
+                # Writes of at most PIPE_BUF bytes don't block.
+                chunk = data[written:written + select.PIPE_BUF]
+                try:
+                    written += os.write(stdin, chunk)
+                except OSError as e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    raise self.died()
+            for fd in readable:
+                chunk = os.read(fd, _BUFSIZE)
+                if not chunk:
+                    raise self.died()
+                handlers[fd](chunk)
+
+    def exchange_lines(self, data, done, on_line, idle_timeout=None):
+        """Like exchange, but passes complete lines of stdout to on_line."""
+        partial_line = ['']
+
+        def on_stdout(chunk):
+            lines = (partial_line[0] + chunk).split('\n')
+            partial_line[0] = lines.pop()
+            for line in lines:
+                on_line(line)
+
+        self.exchange(data, done, on_stdout, idle_timeout=idle_timeout)
+
+    def stderr_tail(self):
+        """The last lines the process wrote to stderr."""
+        return ''.join(self._stderr)
+
+    def died(self):
+        """Kill the process; returns a ProcessDied exception to raise."""
+        _kill(self.process)
+        self.process.wait()
+        return ProcessDied("%s died with exit status %s; error output: %r"
+                           % (self.name, self.process.returncode,
+                              self.stderr_tail()))
+
+    def close(self):
+        """Stop the process."""
+        if self.process is not None:
+            if self.process.poll() is None:
+                logger.info("Stopping %s" % self.name)
+                _kill(self.process)
+            self.process.wait()
+
+
+_BUFSIZE = 65536
+_STDERR_LINES = 50
+
+
+def _drain(stderr, tail):
+    for line in iter(stderr.readline, ''):
+        tail.append(line)
+
+
+def _kill(process):
+    """Kill process and its children."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+_metrics = collections.defaultdict(collections.Counter)
+_metrics_lock = threading.Lock()
+
+
+def _count(name, key, n=1):
+    with _metrics_lock:
+        _metrics[name][key] += n
+
+
+def metrics():
+    """Counters for the external processes run by this worker process.
+
+    Returns a dict mapping tool names to dicts with the number of processes
+    started, requests handled, failures, timeouts, processes recycled after
+    max_requests, and the total time in seconds spent on requests.
+    """
+    with _metrics_lock:
+        return {name: dict(counts) for name, counts in _metrics.items()}
+
+
+def _env(tool, key, convert):
+    value = os.environ.get('XTAS_%s_%s' % (tool.upper(), key))
+    return None if value is None else convert(value)
+
+
+def process_pool(factory, tool, memory=None, **options):
+    """Pool of processes created by factory, configured from environment.
+
+    See the module docstring for the environment variables for tool.
+    memory is the memory needed for a single process; other options are
+    passed to factory.
+    """
+    size = pool_size(_env(tool, 'POOL_SIZE', int),
+                     _env(tool, 'MEMORY', str), memory)
+    options.setdefault('max_requests', _env(tool, 'MAX_REQUESTS', int))
+    options.setdefault('timeout', _env(tool, 'TIMEOUT', float))
+    options.setdefault('start_timeout', _env(tool, 'START_TIMEOUT', float))
+    return Pool(partial(factory, **options), size=size,
+                idle_timeout=_env(tool, 'IDLE_TIMEOUT', float))
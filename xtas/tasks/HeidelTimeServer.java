@@ -0,0 +1,108 @@
+/*
+ * Copyright 2015 Netherlands eScience Center.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+import de.unihd.dbs.heideltime.standalone.DocumentType;
+import de.unihd.dbs.heideltime.standalone.HeidelTimeStandalone;
+import de.unihd.dbs.heideltime.standalone.OutputType;
+import de.unihd.dbs.heideltime.standalone.POSTagger;
+import de.unihd.dbs.uima.annotator.heideltime.resources.Language;
+
+import java.io.BufferedInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.EOFException;
+import java.io.PrintStream;
+import java.util.HashMap;
+import java.util.Map;
+
+
+/*
+ * Heideltime server that communicates over stdin and stdout.
+ *
+ * Each request is a header line "language length", followed by length
+ * bytes of UTF-8 text. Each response is a line holding the length of the
+ * UTF-8 encoded TimeML output, followed by the output itself. Errors are
+ * reported as a response with length -1 and a one-line message.
+ * Stops at EOF.
+ */
+public class HeidelTimeServer {
+    public static void main(String[] args) throws Exception {
+        if (args.length != 1) {
+            System.err.println("usage: java HeidelTimeServer config.props");
+            System.exit(1);
+        }
+
+        // Heideltime prints progress to stdout, which is our channel.
+        PrintStream output = System.out;
+        System.setOut(System.err);
+
+        DataInputStream input = new DataInputStream(
+                                  new BufferedInputStream(System.in));
+        Map<String, HeidelTimeStandalone> taggers =
+            new HashMap<String, HeidelTimeStandalone>();
+
+        for (;;) {
+            String header = readLine(input);
+            if (header == null) {
+                break;
+            }
+            String[] fields = header.split(" ");
+            byte[] doc = new byte[Integer.parseInt(fields[1])];
+            input.readFully(doc);
+
+            byte[] result;
+            try {
+                HeidelTimeStandalone tagger = taggers.get(fields[0]);
+                if (tagger == null) {
+                    tagger = new HeidelTimeStandalone(
+                        Language.getLanguageFromString(fields[0]),
+                        DocumentType.NARRATIVES, OutputType.TIMEML,
+                        args[0], POSTagger.TREETAGGER);
+                    taggers.put(fields[0], tagger);
+                }
+                result = tagger.process(new String(doc, "UTF-8"))
+                               .getBytes("UTF-8");
+            } catch (Exception e) {
+                String msg = String.valueOf(e).replace('\n', ' ');
+                output.print("-1\n" + msg + "\n");
+                output.flush();
+                continue;
+            }
+
+            output.print(result.length + "\n");
+            output.write(result);
+            output.flush();
+        }
+    }
+
+    private static String readLine(DataInputStream input) throws Exception {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        for (;;) {
+            int c = input.read();
+            if (c == -1) {
+                if (line.size() == 0) {
+                    return null;
+                }
+                throw new EOFException();
+            }
+            if (c == '\n') {
+                return line.toString("UTF-8");
+            }
+            line.write(c);
+        }
+    }
+}
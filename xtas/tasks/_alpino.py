@@ -25,11 +25,14 @@ See: http://www.let.rug.nl/vannoord/alp/Alpino
 
 
 import datetime
+import itertools
 import logging
 import os
 import re
 import subprocess
 
+from .._process import ManagedProcess, process_pool
+
 log = logging.getLogger(__name__)
 
 CMD_PARSE = ["bin/Alpino", "end_hook=dependencies", "-parse"]
@@ -64,16 +67,79 @@ def tokenize(text):
     return tokens
 
 
+class _AlpinoParser(ManagedProcess):
+    """Long-running Alpino process, parsing sentences read from stdin.
+
+    Sentences are sent as "key|tokens" lines, so that they are numbered from
+    1 in every document. After the sentences of a document, we send a
+    one-word sentinel sentence with a key that is unique to the request.
+    The dependency triples Alpino prints end in the sentence key, so the
+    first output line with the sentinel key marks the end of the document.
+    Output for sentinels of earlier requests is skipped.
+
+    Alpino prints nothing for a sentence it fails to parse or skips, which
+    may happen to the sentinel as well. Once the last sentence of the
+    document has been answered, we therefore wait at most sentinel_timeout
+    seconds for the sentinel.
+    """
+
+    name = "alpino"
+    sentinel_timeout = 10.
+
+    def __init__(self, **options):
+        self.cwd = os.environ['ALPINO_HOME']
+        self.env = {'ALPINO_HOME': self.cwd}
+        self._requests = itertools.count()
+        super(_AlpinoParser, self).__init__(**options)
+
+    def command(self):
+        return CMD_PARSE
+
+    def parse(self, tokens):
+        """Parse tokens, as returned by tokenize; returns the raw output."""
+        return self.request(tokens)
+
+    def communicate(self, tokens):
+        eot = "%s%d" % (_SENTINEL, next(self._requests))
+        sentences = [s for s in tokens.splitlines() if s.strip()]
+        data = ''.join("%d|%s\n" % (i, s)
+                       for i, s in enumerate(sentences, 1))
+        data += "%s|%s\n" % (eot, _SENTINEL_SENTENCE)
+
+        last = str(len(sentences)) if sentences else None
+        lines, done, answered = [], [], [last is None]
+
+        def on_line(line):
+            key = line.rsplit("|", 1)[-1]
+            if key == eot:
+                done.append(True)
+            elif not done and not key.startswith(_SENTINEL):
+                lines.append(line)
+                if key == last:
+                    answered[0] = True
+
+        def idle_timeout():
+            return self.sentinel_timeout if answered[0] else None
+
+        self.exchange_lines(data, lambda: done, on_line, idle_timeout)
+        if not done:
+            log.warn("No output from Alpino for the end-of-document marker "
+                     "%s; assuming the document is done" % eot)
+        return ''.join(l + "\n" for l in lines)
+
+
+_SENTINEL = "xtas-eot-"
+_SENTINEL_SENTENCE = "klaar"
+
+_pool = process_pool(_AlpinoParser, 'alpino')
+
+
 def parse_raw(tokens):
-    alpino_home = os.environ['ALPINO_HOME']
-    p = subprocess.Popen(CMD_PARSE, shell=False,
-                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         cwd=alpino_home, env={'ALPINO_HOME': alpino_home})
-    parse, err = p.communicate(tokens)
+    with _pool.checkout() as parser:
+        parse = parser.parse(tokens)
     if not parse:
-        raise Exception("Parse problem. Output was {parse!r}, "
-                        "error messages: {err!r}".format(**locals()))
+        raise Exception("Parse problem. Output was {parse!r}"
+                        .format(**locals()))
     return parse
 
 
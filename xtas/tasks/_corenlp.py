@@ -18,21 +18,24 @@ Wrapper around the CoreNLP toolkit.
 
 import collections
 from datetime import datetime
+from functools import partial
 import io
 import logging
 import os
 import os.path
 import re
-import subprocess
 import threading
-import time
 import unicodedata
 
-from corenlp_xml.document import Document
-
 from six import iteritems
 
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:     # Python 3 (removed in 3.9)
+    from xml.etree.ElementTree import iterparse
+
 from .._downloader import download_zip
+from .._process import ManagedProcess, process_pool
 
 
 log = logging.getLogger(__name__)
@@ -40,101 +43,190 @@ log = logging.getLogger(__name__)
 _CORENLP_VERSION = None
 
 
-class _StanfordCoreNLP(object):
-
-    _singletons = {}  # annotators : object
+class _StanfordCoreNLP(ManagedProcess):
 
-    @classmethod
-    def get_singleton(cls, annotators=None, **options):
-        """
-        Get or create a corenlp parser with the given annotator and options
-        Note: multiple parsers with the same annotator and different options
-              are not supported.
-        """
-        if annotators is not None:
-            annotators = tuple(annotators)
-        if annotators not in cls._singletons:
-            cls._singletons[annotators] = cls(annotators, **options)
-        return cls._singletons[annotators]
+    name = "corenlp"
+    # exec, so that the shell is replaced by the JVM.
+    shell = True
+    # We read stderr ourselves, for the prompts.
+    drain_stderr = False
 
-    def __init__(self, annotators=None, timeout=1000, memory="3G"):
+    def __init__(self, annotators=None, memory="3G", **options):
         """
         Start the CoreNLP server with a system call.
 
         @param annotators: Which annotators to use, e.g.
                            ["tokenize", "ssplit", "pos", "lemma"]
         @param memory: Java heap memory to use
+        @param options: Passed to ManagedProcess (timeout, max_requests)
         """
-        global _CORENLP_VERSION
         self.annotators = annotators
         self.memory = memory
+        self._err = ''
+        super(_StanfordCoreNLP, self).__init__(**options)
+
+    def command(self):
+        global _CORENLP_VERSION
         _CORENLP_VERSION = get_corenlp_version()
-        self._start_corenlp()
-
-    def _start_corenlp(self):
-        cmd = _get_command(memory=self.memory, annotators=self.annotators)
-        log.info("Starting corenlp: {cmd}".format(**locals()))
-        self.corenlp_process = subprocess.Popen(cmd, shell=True,
-                                                stdin=subprocess.PIPE,
-                                                stdout=subprocess.PIPE,
-                                                stderr=subprocess.PIPE)
-        self.lock = threading.Lock()
-        self.read_thread = threading.Thread(target=self._read_output_lines)
-        self.read_thread.daemon = True
-        self.read_thread.start()
+        return "exec " + _get_command(memory=self.memory,
+                                      annotators=self.annotators)
+
+    def handshake(self):
         log.debug("Waiting for prompt")
-        self._communicate(input=None, wait_for_output=False)
-
-    def _read_output_lines(self):
-        "intended to be run as background thread to collect parser output"
-        while True:
-            chars = self.corenlp_process.stdout.readline()
-            if chars == '':  # EOF
-                break
-            self.out.write(chars)
-
-    def _communicate(self, input, wait_for_output=True):
-        log.debug("Sending {} bytes to corenlp".format(input and len(input)))
-        if self.corenlp_process.poll() is not None:
-            logging.info("CoreNLP process died, respawning")
-            self._start_corenlp()
-        with self.lock:
-            self.out = io.BytesIO()
-            if input:
-                self.corenlp_process.stdin.write(input)
-                self.corenlp_process.stdin.write("\n\n")
-                self.corenlp_process.stdin.flush()
-
-            # wait until we get a prompt
-            logging.debug("Waiting for NLP>")
-            err_buffer = io.BytesIO()
-            while True:
-                char = self.corenlp_process.stderr.read(1)
-                err_buffer.write(char)
-                err_buffer.seek(-5, 2)
-                if err_buffer.read() == "NLP> ":
-                    break
-
-        # give stdout a chance to flush
-        # is there a better way to do this?
-        while True:
-            time.sleep(.1)
-            result = self.out.getvalue()
-            if result or not wait_for_output:
-                return result
+        self._err = ''
+        self.communicate([])
+
+    def communicate(self, lines):
+        """Send lines of input to CoreNLP and wait for the results.
+
+        CoreNLP, in interactive mode, reads documents from stdin one line at
+        a time, writes an XML document per line to stdout and then prints
+        the prompt "NLP> " on stderr. We write all lines up front, read from
+        whichever pipe has data available, and return as soon as every line
+        has been answered with both its XML and a prompt.
+
+        Returns a list with the XML for every line (empty for empty lines,
+        which get a prompt but no XML; whitespace still gets XML). With no
+        lines, only waits for the prompt (used at startup).
+        """
+        data = ''.join(lines)
+        log.debug("Sending {} lines, {} bytes to corenlp"
+                  .format(len(lines), len(data)))
+        n_xml = sum(1 for line in lines if line.rstrip("\r\n"))
+        n_prompts = max(len(lines), 1)
+
+        docs = []           # completed XML documents
+        state = {'out': '', 'prompts': 0}   # partial document, prompts seen
+
+        def on_stdout(chunk):
+            out = state['out'] + chunk
+            while _XML_END in out:
+                end = out.index(_XML_END) + len(_XML_END)
+                docs.append(out[:end] + "\n")
+                out = out[end:].lstrip("\n")
+            state['out'] = out
+
+        def on_stderr(chunk):
+            err = self._err
+            # A prompt may be split over two chunks, so count in
+            # everything since the last prompt seen.
+            last = err.rfind(_PROMPT)
+            pending = err[last + len(_PROMPT):] if last >= 0 else err
+            state['prompts'] += (pending + chunk).count(_PROMPT)
+            # Keep only the end, for the prompt and error messages.
+            self._err = (err + chunk)[-_ERR_TAIL:]
+
+        def done():
+            return len(docs) >= n_xml and state['prompts'] >= n_prompts
+
+        self.exchange(data, done, on_stdout, on_stderr)
+
+        docs = iter(docs)
+        return [next(docs) if line.rstrip("\r\n") else '' for line in lines]
+
+    def size(self, lines):
+        return len(lines)
+
+    def stderr_tail(self):
+        return self._err
 
     def parse(self, text):
         """Call the server and return the raw results."""
-        if not isinstance(text, bytes):
-            text = unicodedata.normalize('NFKD', text)
-            text = text.encode('ascii', errors='ignore')
-        text = re.sub("\s+", " ", text)
-        return self._communicate(text + "\n")
+        return self.parse_many([text])[0]
+
+    def parse_many(self, texts):
+        """Call the server on a batch of texts and return the raw results.
+
+        Blank texts and "q", which would make CoreNLP quit, are not sent;
+        their result is ''.
+        """
+        lines = [_prepare(text) for text in texts]
+        send = [line for line in lines if _sendable(line)]
+        results = iter(self.request(send) if send else [])
+        return [next(results) if _sendable(line) else '' for line in lines]
+
+
+def _prepare(text):
+    """Turn text into a single line of ASCII input for CoreNLP."""
+    if not isinstance(text, bytes):
+        text = unicodedata.normalize('NFKD', text)
+        text = text.encode('ascii', errors='ignore')
+    text = re.sub("\s+", " ", text).strip()
+    return text + "\n"
+
+
+def _sendable(line):
+    """Whether CoreNLP's shell can be given line as a document."""
+    return line.strip().lower() not in ('', 'q')
+
+
+_ERR_TAIL = 4096
+_PROMPT = "NLP> "
+_XML_END = "</root>"
+
+_pools = {}     # annotators : Pool
+_pools_lock = threading.Lock()
+
+
+# Annotators needed for lemmatization.
+LEMMATIZE = ('tokenize', 'ssplit', 'pos', 'lemma')
+
+# Annotators with large models. Without these, a small heap suffices.
+_HEAVY_ANNOTATORS = frozenset(['ner', 'regexner', 'parse', 'depparse',
+                               'dcoref', 'coref', 'sentiment', 'relation',
+                               'natlog', 'openie'])
+
+
+def _annotators(annotators):
+    """Normalize annotators, given as a list or a comma-separated string."""
+    if annotators is None:
+        return None
+    if isinstance(annotators, basestring):
+        annotators = annotators.split(',')
+    return tuple(a.strip() for a in annotators if a.strip())
+
+
+def _memory(annotators):
+    """Java heap size for a CoreNLP process with the given annotators."""
+    if annotators is None or _HEAVY_ANNOTATORS.intersection(annotators):
+        return "3G"
+    return "1G"
+
+
+def _get_pool(annotators=None, memory=None, **options):
+    """Get or create the pool of CoreNLP processes for annotators.
+
+    The memory (Java heap size) for each process is determined from the
+    annotators, unless given.
+
+    Note: multiple pools with the same annotators and different options
+          are not supported.
+    """
+    annotators = _annotators(annotators)
+    memory = memory or _memory(annotators)
+    with _pools_lock:
+        if annotators not in _pools:
+            # memory sizes the pool; the processes need it as well.
+            factory = partial(_StanfordCoreNLP, memory=memory)
+            _pools[annotators] = process_pool(factory, 'corenlp',
+                                              memory=memory,
+                                              annotators=annotators,
+                                              **options)
+        return _pools[annotators]
 
 
 def parse(text, annotators=None, **options):
-    s = _StanfordCoreNLP.get_singleton(annotators, **options)
-    return s.parse(text, **options)
+    with _get_pool(annotators, **options).checkout() as s:
+        return s.parse(text)
+
+
+def parse_many(texts, annotators=None, **options):
+    """Parse a batch of texts in a single round trip to CoreNLP.
+
+    Returns a list of raw results, one per text.
+    """
+    with _get_pool(annotators, **options).checkout() as s:
+        return s.parse_many(texts)
 
 
 # Stanford CoreNLP 3.4.1. Later versions require Java 8.
@@ -174,7 +266,15 @@ def _get_command(annotators=None, memory=None):
 
 
 def stanford_to_saf(xml_bytes):
-    doc = Document(xml_bytes)
+    """Convert CoreNLP XML output to a SAF dictionary.
+
+    Walks the XML once, converting elements as soon as they are complete and
+    discarding them afterwards, so the XML tree is never held in memory as a
+    whole.
+
+    The empty result that parse gives for a blank text converts to a SAF
+    document without tokens.
+    """
     saf = collections.defaultdict(list)
 
     saf['header'] = {'format': "SAF",
@@ -183,7 +283,11 @@ def stanford_to_saf(xml_bytes):
                                     'module-version': _CORENLP_VERSION,
                                     "started": datetime.now().isoformat()}
                      }
+    if not xml_bytes.strip():
+        return {'header': saf['header'], 'tokens': []}
+
     tokens = {}     # (xml_sentid, xml_tokenid) : saf_tokenid
+    sentence_tokens = collections.defaultdict(list)  # xml_sentid : [saf_id]
 
     def tokenid(sentid, tokenid):
         if (sentid, tokenid) in tokens:
@@ -191,38 +295,83 @@ def stanford_to_saf(xml_bytes):
                              .format(**locals()))
         saf_tokenid = len(tokens) + 1
         tokens[sentid, tokenid] = saf_tokenid
+        sentence_tokens[sentid].append(saf_tokenid)
         return saf_tokenid
 
-    for sent in doc.sentences:
-        saf['tokens'] += [dict(id=tokenid(sent.id, t.id),
-                               sentence=sent.id,
-                               offset=t.character_offset_begin,
-                               lemma=t.lemma, word=t.word,
-                               pos=t.pos, pos1=_POSMAP[t.pos])
-                          for t in sent.tokens]
-
-        saf['entities'] += [{'tokens': [tokens[sent.id, t.id]], 'type': t.ner}
-                            for t in sent.tokens if t.ner not in (None, 'O')]
-
-        if sent.collapsed_ccprocessed_dependencies:
-            links = sent.collapsed_ccprocessed_dependencies.links
-            saf['dependencies'] += [{'child': tokens[sent.id,
-                                                     dep.dependent.idx],
-                                     'parent': tokens[sent.id,
-                                                      dep.governor.idx],
-                                     'relation': dep.type}
-                                    for dep in links if dep.type != 'root']
-
-    if doc.coreferences:
-        saf['coreferences'] = [[[tokens[m.sentence.id, t.id] for t in m.tokens]
-                                for m in coref.mentions]
-                               for coref in doc.coreferences]
-    saf['trees'] = [{'sentence': s.id, 'tree': s.parse_string.strip()}
-                    for s in doc.sentences if s.parse_string is not None]
+    path = []           # tags of the open elements
+    sentid = None
+    have_deps = False   # seen the dependencies of the current sentence?
+    mentions = []       # mentions of the current coreference chain
+
+    for event, elem in iterparse(io.BytesIO(xml_bytes), ('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            if path[-2:] == ['sentences', 'sentence']:
+                sentid = int(elem.get('id'))
+                have_deps = False
+            continue
+
+        path.pop()
+        tag = elem.tag
+        parent = path[-1] if path else None
+
+        if tag == 'token' and parent == 'tokens':
+            saf_id = tokenid(sentid, int(elem.get('id')))
+            pos = elem.findtext('POS')
+            offset = elem.findtext('CharacterOffsetBegin')
+            saf['tokens'].append(dict(id=saf_id, sentence=sentid,
+                                      offset=offset and int(offset),
+                                      lemma=elem.findtext('lemma'),
+                                      word=elem.findtext('word'),
+                                      pos=pos, pos1=_POSMAP[pos]))
+            ner = elem.findtext('NER')
+            if ner not in (None, 'O'):
+                saf['entities'].append({'tokens': [saf_id], 'type': ner})
+            elem.clear()
+
+        elif tag == 'dependencies' and parent == 'sentence':
+            if (not have_deps and elem.get('type')
+                    == 'collapsed-ccprocessed-dependencies'):
+                have_deps = True
+                for dep in elem.iterfind('dep'):
+                    rel = dep.get('type')
+                    if rel == 'root':
+                        continue
+                    child = int(dep.find('dependent').get('idx'))
+                    governor = int(dep.find('governor').get('idx'))
+                    saf['dependencies'].append(
+                        {'child': tokens[sentid, child],
+                         'parent': tokens[sentid, governor],
+                         'relation': rel})
+            elem.clear()
+
+        elif tag == 'parse' and parent == 'sentence':
+            if elem.text is not None:
+                saf['trees'].append({'sentence': sentid,
+                                     'tree': elem.text.strip()})
+            elem.clear()
+
+        elif tag == 'sentence' and parent == 'sentences':
+            elem.clear()
+
+        elif tag == 'mention' and path[-2:] == ['coreference',
+                                                'coreference']:
+            # Token positions are 1-based; end is exclusive.
+            start = int(elem.findtext('start'))
+            end = int(elem.findtext('end'))
+            sent = sentence_tokens[int(elem.findtext('sentence'))]
+            mentions.append(sent[start - 1:end - 1])
+            elem.clear()
+
+        elif tag == 'coreference' and parent == 'coreference':
+            saf['coreferences'].append(mentions)
+            mentions = []
+            elem.clear()
 
     # remove default and empty elements
     return {k: v for (k, v) in iteritems(saf) if v != []}
 
+
 _POSMAP = {'CC': 'C',
            'CD': 'Q',
            'DT': 'D',
@@ -21,7 +21,12 @@ See xtas.tasks.single.frog, http://ilk.uvt.nl/frog/.
 import datetime
 import logging
 import os
+import select
 import socket
+import threading
+import time
+
+from .._process import ProcessTimeout
 
 _FROG_HOST = "localhost"
 _FROG_PORT = os.environ.get('XTAS_FROG_PORT', 9887)
@@ -31,6 +36,35 @@ except Exception as e:
     logging.warn("$XTAS_FROG_PORT not recognized as port number, using %d: %r"
                  % (_FROG_PORT, e))
 
+
+def _parse_hosts(spec):
+    """Parse a comma-separated list of host[:port] into (host, port) pairs."""
+    hosts = []
+    for address in spec.split(','):
+        address = address.strip()
+        if not address:
+            continue
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            hosts.append((host, int(port)))
+        else:
+            hosts.append((address, _FROG_PORT))
+    return hosts
+
+
+# Frog servers to connect to, e.g. XTAS_FROG_HOSTS=host1:9887,host2:9887.
+_FROG_HOSTS = _parse_hosts(os.environ.get('XTAS_FROG_HOSTS', '')) or [
+    (_FROG_HOST, _FROG_PORT)]
+# Maximum number of concurrent requests (and thus open connections) per Frog
+# server, for a single worker process.
+_FROG_MAX_INFLIGHT = int(os.environ.get('XTAS_FROG_MAX_INFLIGHT', 4))
+# Number of seconds a Frog server that failed is left alone.
+_FROG_EJECT_TIME = float(os.environ.get('XTAS_FROG_EJECT_TIME', 30))
+# Maximum number of seconds to wait for a connection or for Frog's output.
+_FROG_TIMEOUT = os.environ.get('XTAS_FROG_TIMEOUT')
+if _FROG_TIMEOUT is not None:
+    _FROG_TIMEOUT = float(_FROG_TIMEOUT)
+
 _POSMAP = {"VZ": "P",
            "N": "N",
            "ADJ": "A",
@@ -48,26 +82,230 @@ _POSMAP = {"VZ": "P",
            }
 
 
+class _FrogConnection(object):
+    """Persistent connection to a Frog server.
+
+    Documents are sent one after the other over the same connection, each
+    terminated by a line "EOT". Frog answers every document with its output
+    lines followed by a line "READY".
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = socket.create_connection(self.address, timeout)
+        self.reader = self.sock.makefile('r')
+
+    def alive(self):
+        """Health check: has the server not closed the connection?"""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        # An idle connection only becomes readable when the peer closes it
+        # (or sends garbage, in which case we don't want it either).
+        return not readable
+
+    def process(self, text):
+        """Send text (a UTF-8 string ending in a newline) to Frog.
+
+        Returns the output lines. Raises ProcessTimeout if Frog doesn't
+        answer within the timeout; the connection is then unusable.
+        """
+        try:
+            self.sock.sendall(text + "EOT\n")
+            lines = []
+            for line in iter(self.reader.readline, ''):
+                line = line.strip('\n')
+                if line == "READY":
+                    return lines
+                lines.append(line)
+        except socket.timeout:
+            raise ProcessTimeout("Frog at %s:%d did not answer within %g "
+                                 "seconds" % (self.address + (self.timeout,)))
+        raise socket.error("connection to Frog at %s:%d closed unexpectedly"
+                           % self.address)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class _FrogEndpoint(object):
+    """A Frog server with its idle connections and current load."""
+
+    def __init__(self, host, port, max_inflight):
+        self.address = (host, port)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.idle = []
+        self.dead_until = 0
+
+
+class FrogClient(object):
+    """Load-balancing client for one or more Frog servers.
+
+    Every request goes to the server with the least outstanding requests
+    from this client, subject to a per-server limit on concurrent requests;
+    when all servers are at their limit, requests wait. Connections are kept
+    open and reused for subsequent documents. Idle connections are checked
+    before reuse; a connection that turns out to be broken is replaced by a
+    new one.
+
+    A server that cannot be reached is ejected for eject_time seconds and
+    its requests are retried on the other servers. When all servers have been
+    ejected, they are tried anyway.
+
+    Parameters
+    ----------
+    hosts : list of (string, int) or (string, int, int), optional
+        Addresses of Frog servers, optionally with a per-server limit that
+        overrides max_inflight. Defaults to $XTAS_FROG_HOSTS, or
+        localhost:$XTAS_FROG_PORT if that is not set.
+    max_inflight : int, optional
+        Maximum number of concurrent requests per server. Defaults to
+        $XTAS_FROG_MAX_INFLIGHT, or 4 if that is not set.
+    eject_time : float, optional
+        Number of seconds to avoid a failed server. Defaults to
+        $XTAS_FROG_EJECT_TIME, or 30 if that is not set.
+    timeout : float, optional
+        Maximum number of seconds to wait for a connection, or for the
+        output for a document. A document that times out fails with
+        ProcessTimeout; it is not retried and the server is not ejected,
+        since the document rather than the server is the likely culprit.
+        Defaults to $XTAS_FROG_TIMEOUT, or no timeout.
+    """
+
+    def __init__(self, hosts=None, max_inflight=None, eject_time=None,
+                 timeout=None):
+        max_inflight = max_inflight or _FROG_MAX_INFLIGHT
+        self.endpoints = []
+        for address in hosts or _FROG_HOSTS:
+            host, port = address[:2]
+            limit = address[2] if len(address) > 2 else max_inflight
+            self.endpoints.append(_FrogEndpoint(host, port, limit))
+        self.eject_time = (_FROG_EJECT_TIME if eject_time is None
+                           else eject_time)
+        self.timeout = _FROG_TIMEOUT if timeout is None else timeout
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        """Pick the least loaded server, waiting if all are busy."""
+        with self._cond:
+            while True:
+                now = time.time()
+                free = [e for e in self.endpoints
+                        if e.inflight < e.max_inflight]
+                healthy = [e for e in free if e.dead_until <= now]
+                if not healthy and all(e.dead_until > now
+                                       for e in self.endpoints):
+                    healthy = free
+                if healthy:
+                    endpoint = min(healthy, key=lambda e: e.inflight)
+                    endpoint.inflight += 1
+                    return endpoint
+                self._cond.wait()
+
+    def _release(self, endpoint, conn=None, failed=False):
+        with self._cond:
+            endpoint.inflight -= 1
+            if failed:
+                logging.warn("Frog server at %s:%d failed, ejecting it for "
+                             "%g seconds" % (endpoint.address
+                                             + (self.eject_time,)))
+                endpoint.dead_until = time.time() + self.eject_time
+                for idle in endpoint.idle:
+                    idle.close()
+                del endpoint.idle[:]
+            elif conn is not None:
+                endpoint.dead_until = 0
+                endpoint.idle.append(conn)
+            self._cond.notify()
+
+    def _checkout(self, endpoint):
+        """Get a connection to endpoint. Returns (conn, reused)."""
+        with self._cond:
+            while endpoint.idle:
+                conn = endpoint.idle.pop()
+                if conn.alive():
+                    return conn, True
+                logging.info("Connection to Frog at %s:%d lost" % conn.address)
+                conn.close()
+        return _FrogConnection(*endpoint.address,
+                               timeout=self.timeout), False
+
+    def process(self, text):
+        """Run text through Frog and return the output lines."""
+        if not text.endswith("\n"):
+            text = text + "\n"
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        error = None
+        for _ in range(len(self.endpoints)):
+            endpoint = self._acquire()
+            conn = None
+            try:
+                conn, reused = self._checkout(endpoint)
+                try:
+                    lines = conn.process(text)
+                except socket.error:
+                    if not reused:
+                        raise
+                    # The server may have dropped the connection between the
+                    # health check and the request. Try a fresh one.
+                    conn.close()
+                    conn = _FrogConnection(*endpoint.address,
+                                           timeout=self.timeout)
+                    lines = conn.process(text)
+            except socket.error as e:
+                if conn is not None:
+                    conn.close()
+                self._release(endpoint, failed=True)
+                error = e
+                continue
+            except:
+                if conn is not None:
+                    conn.close()
+                self._release(endpoint)
+                raise
+            self._release(endpoint, conn)
+            return lines
+
+        raise error
+
+    def close(self):
+        """Close all idle connections."""
+        with self._cond:
+            for endpoint in self.endpoints:
+                for conn in endpoint.idle:
+                    conn.close()
+                del endpoint.idle[:]
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+    """Get the FrogClient shared by all threads in this process."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = FrogClient()
+        return _CLIENT
+
+
 def call_frog(text):
     """
-    Call the frog parser on the given host and port with the given text
+    Call the frog parser on the configured Frog server(s) with the given text
     Is a generator over the output lines.
     """
-    if not text.endswith("\n"):
-        text = text + "\n"
-    if not isinstance(text, unicode):
-        text = unicode(text)
-
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((_FROG_HOST, _FROG_PORT))
-    s.sendall(text)
-    s.shutdown(socket.SHUT_WR)
-    for line in s.makefile('r'):
-        line = line.strip('\n')
-        if line == "READY":
-            return
-        else:
-            yield line
+    for line in get_client().process(text):
+        yield line
 
 
 def parse_frog(lines):
@@ -13,14 +13,20 @@
 # limitations under the License.
 
 import errno
+import logging
 import os
-from os.path import join
+from os.path import dirname, exists, join
 import shutil
 import subprocess
 import tempfile
+import threading
 import xml.etree.ElementTree as etree
 
 from .._downloader import download_zip, make_data_home
+from .._process import ManagedProcess, process_pool
+
+
+log = logging.getLogger(__name__)
 
 
 def _set_treetagger_home(heideltime_dir):
@@ -61,37 +67,109 @@ def _set_treetagger_home(heideltime_dir):
 
 # None signals not initialized.
 _config_props = None
-_jar = None
+_classpath = None
+_init_lock = threading.Lock()
 
 
 def _initialize():
-    # XXX We should synchronize across worker threads.
-    global _config_props, _jar
-    if _config_props is not None:
-        return
+    global _config_props, _classpath
+    with _init_lock:
+        if _config_props is not None:
+            return
 
-    _zip = 'https://github.com/HeidelTime/heideltime/releases/download/VERSION2.1/heideltime-standalone-2.1.zip'
+        _zip = 'https://github.com/HeidelTime/heideltime/releases/download/VERSION2.1/heideltime-standalone-2.1.zip'
 
-    _heideltime_dir = download_zip(url=_zip, name='Heideltime',
-                                    check_dir='heideltime-standalone')
-    _config_props = _set_treetagger_home(_heideltime_dir)
-    _jar = join(_heideltime_dir, 'de.unihd.dbs.heideltime.standalone.jar')
+        heideltime_dir = download_zip(url=_zip, name='Heideltime',
+                                      check_dir='heideltime-standalone')
+        jar = join(heideltime_dir, 'de.unihd.dbs.heideltime.standalone.jar')
+        server_dir = _compile_server(jar, heideltime_dir)
 
+        _classpath = '%s:%s' % (jar, server_dir)
+        _config_props = _set_treetagger_home(heideltime_dir)
 
-def call_heideltime(doc, language, output):
-    """Implementation of tasks.heideltime; see there for documentation."""
+
+def _compile_server(jar, heideltime_dir):
+    """Compile HeidelTimeServer against the downloaded Heideltime jar.
+
+    A HeidelTimeServer.class shipped with xtas is used as-is; compiling
+    requires a Java Development Kit (javac).
+
+    Returns the directory that holds HeidelTimeServer.class.
+    """
+    for directory in [dirname(__file__), heideltime_dir]:
+        if exists(join(directory, 'HeidelTimeServer.class')):
+            return directory
+    source = join(dirname(__file__), 'HeidelTimeServer.java')
+    log.info("Compiling %s" % source)
+    try:
+        subprocess.check_call(['javac', '-cp', jar, '-d', heideltime_dir,
+                               source])
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        raise RuntimeError("javac not found; Heideltime needs a Java"
+                           " Development Kit (JDK) to compile %s, or a"
+                           " precompiled HeidelTimeServer.class in %s"
+                           % (source, heideltime_dir))
+    return heideltime_dir
+
+
+class _HeidelTimeServer(ManagedProcess):
+    """Resident Heideltime process; see HeidelTimeServer.java.
+
+    Loading Heideltime and TreeTagger takes seconds, so we keep a JVM
+    running and send it documents over a pipe.
+    """
+
+    name = "heideltime"
+
+    def command(self):
+        _initialize()
+        return ['java', '-cp', _classpath, 'HeidelTimeServer', _config_props]
+
+    def process_doc(self, doc, language):
+        """Tag a single document; returns TimeML."""
+        if isinstance(doc, unicode):
+            doc = doc.encode('utf-8')
+        return self.request(doc, language)
+
+    def communicate(self, doc, language):
+        data = '%s %d\n%s' % (language, len(doc), doc)
+        # The response is a header line with the length of the output,
+        # or -1 followed by an error message, then the output.
+        state = {'length': None, 'out': ''}
+
+        def on_stdout(chunk):
+            out = state['out'] + chunk
+            if state['length'] is None and '\n' in out:
+                header, out = out.split('\n', 1)
+                state['length'] = int(header)
+            state['out'] = out
+
+        def done():
+            length = state['length']
+            if length == -1:
+                return '\n' in state['out']
+            return length is not None and len(state['out']) >= length
+
+        self.exchange(data, done, on_stdout)
+        if state['length'] == -1:
+            raise ValueError("Heideltime error: %s"
+                             % state['out'].split('\n')[0])
+        return state['out']
+
+
+_pool = process_pool(_HeidelTimeServer, 'heideltime')
+
+
+def _check_output_format(output):
     output = output.lower()
     if output not in ["timeml", "dicts", "values"]:
         raise ValueError("unknown output format %r" % output)
+    return output
 
-    with tempfile.NamedTemporaryFile(prefix='xtas-heideltime') as f:
-        f.write(doc.encode('utf-8') if isinstance(doc, unicode) else doc)
-        f.flush()
-        out = subprocess.check_output(['java', '-jar', _jar,
-                                       '-c', _config_props,
-                                       '-l', language, '-pos', 'treetagger',
-                                       f.name])
 
+def _convert(out, output):
     # Heideltime doesn't always escape its ampersands correctly.
     out = out.replace('&', '&amp;')
 
@@ -103,3 +181,19 @@ def call_heideltime(doc, language, output):
             out = [timex.attrib['value'] for timex in out]
 
     return out
+
+
+def call_heideltime(doc, language, output):
+    """Implementation of tasks.heideltime; see there for documentation."""
+    output = _check_output_format(output)
+    with _pool.checkout() as server:
+        out = server.process_doc(doc, language)
+    return _convert(out, output)
+
+
+def call_heideltime_many(docs, language, output):
+    """Implementation of tasks.heideltime_many; see there for documentation."""
+    output = _check_output_format(output)
+    with _pool.checkout() as server:
+        return [_convert(server.process_doc(doc, language), output)
+                for doc in docs]
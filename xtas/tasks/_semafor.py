@@ -40,74 +40,130 @@ from __future__ import absolute_import
 import datetime
 import json
 import os
-import threading
+import re
 import subprocess
 import tempfile
 
+from .._process import ManagedProcess, process_pool
 
-class _Semafor(object):
-    def __init__(self):
-        self.start_semafor()
 
-    def start_semafor(self):
+class _Semafor(ManagedProcess):
+
+    name = "semafor"
+
+    def command(self):
         semafor_home = os.environ["SEMAFOR_HOME"]
         model_dir = os.environ.get("MALT_MODEL_DIR", semafor_home)
         cp = os.path.join(semafor_home, "target", "Semafor-3.0-alpha-04.jar")
-        cmd = ["java", "-Xms4g", "-Xmx4g", "-cp", cp,
-               "edu.cmu.cs.lti.ark.fn.SemaforInteractive",
-               "model-dir:" + model_dir]
-        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
-                                        stdout=subprocess.PIPE)
-        for _ in self._read_next_output():
-            pass
-
-    def _read_next_output(self):
-        while True:
-            line = self.process.stdout.readline()
-            if line == '':
-                raise Exception("Unexpected EOF")
+        return ["java", "-Xms4g", "-Xmx4g", "-cp", cp,
+                "edu.cmu.cs.lti.ark.fn.SemaforInteractive",
+                "model-dir:" + model_dir]
+
+    def handshake(self):
+        self.communicate([])
+
+    def communicate(self, conll_strs):
+        """Send all sentences, then read the results.
+
+        SemaforInteractive prints a ">>>" prompt at startup and after the
+        JSON output for every sentence. Since reading and writing are
+        interleaved, Semafor starts on the next sentence while we read the
+        previous result.
+        """
+        data = "".join(conll_str.strip() + "\n\n" for conll_str in conll_strs)
+        outputs = [[]]      # output lines per prompt
+
+        def on_line(line):
             if line.strip() == ">>>":
-                break
-            yield line
+                outputs.append([])
+            else:
+                outputs[-1].append(line)
+
+        # With no sentences, wait for the startup prompt.
+        n_prompts = max(len(conll_strs), 1)
+        self.exchange_lines(data, lambda: len(outputs) > n_prompts, on_line)
+
+        results = []
+        for lines in outputs[:len(conll_strs)]:
+            line, = lines   # Raises if len(lines) != 1.
+            results.append(json.loads(line))
+        return results
+
+    def size(self, conll_strs):
+        return len(conll_strs)
 
     def call_semafor(self, conll_str):
-        self.process.stdin.write(conll_str.strip())
-        self.process.stdin.write("\n\n")
-        self.process.stdin.flush()
-        lines = list(self._read_next_output())
-        line, = lines   # Raises if len(lines) != 1.
-        return json.loads(line)
+        result, = self.call_semafor_many([conll_str])
+        return result
 
+    def call_semafor_many(self, conll_strs):
+        return self.request(conll_strs)
 
-_SINGLETON_LOCK = threading.Lock()
+
+# Each Semafor process takes 4GB of memory.
+_pool = process_pool(_Semafor, 'semafor', memory="4G")
 
 
 def call_semafor(conll_str):
     """
-    Call semafor on the given conll_str using a thread-safe singleton instance
+    Call semafor on the given conll_str using a pooled instance
     """
-    with _SINGLETON_LOCK:
-        if not hasattr(_Semafor, 'singleton'):
-            _Semafor.singleton = _Semafor()
-        return _Semafor.singleton.call_semafor(conll_str)
+    with _pool.checkout() as semafor:
+        return semafor.call_semafor(conll_str)
+
+
+def call_semafor_many(conll_strs):
+    """
+    Call semafor on each of the given conll strings, using one pooled
+    instance, sending all of them before reading the results.
+    """
+    if not conll_strs:
+        return []
+    with _pool.checkout() as semafor:
+        return semafor.call_semafor_many(conll_strs)
 
 
 def to_conll(tree):
     """
     Convert a parse tree from Penn (?) to conll
     """
+    conll, = to_conll_many([tree])
+    return conll
+
+
+def to_conll_many(trees):
+    """
+    Convert a list of parse trees to conll in a single Java call.
+
+    Returns a list with the conll string for each tree.
+    """
+    if not trees:
+        return []
     classpath = os.path.join(os.environ["CORENLP_HOME"], "*")
     javaclass = "edu.stanford.nlp.trees.EnglishGrammaticalStructure"
     # create stub xml file and call the conll class
-    xml = ("<root><document><sentences><sentence>{tree}"
-           "</sentence></sentences></document></root>"
+    sentences = "".join("<sentence>{}</sentence>".format(tree)
+                        for tree in trees)
+    xml = ("<root><document><sentences>{sentences}"
+           "</sentences></document></root>"
            .format(**locals()))
     with tempfile.NamedTemporaryFile() as f:
         f.write(xml)
         f.flush()
         cmd = ['java', '-cp', classpath, javaclass, '-conllx',
                '-treeFile', f.name]
-        return subprocess.check_output(cmd, shell=False)
+        out = subprocess.check_output(cmd, shell=False)
+    return _split_conll(out, len(trees))
+
+
+def _split_conll(out, n):
+    """Split the conll output for n sentences, separated by blank lines."""
+    conlls = [s + "\n" for s in re.split(r"\n\s*\n", out.strip())
+              if s.strip()]
+    if len(conlls) != n:
+        raise ValueError("Expected conll output for {} trees, got {}"
+                         .format(n, len(conlls)))
+    return conlls
 
 
 def add_frames(saf_article):
@@ -120,16 +176,16 @@ def add_frames(saf_article):
                   "started": datetime.datetime.now().isoformat()}
     saf_article['header']['processed'].append(provenance)
 
-    for t in saf_article['trees']:
+    trees = saf_article['trees']
+    conlls = to_conll_many([t['tree'] for t in trees])
+    sents = call_semafor_many(conlls)
+    for t, sent in zip(trees, sents):
         sid = int(t['sentence'])
-        tree = t['tree']
-        conll = to_conll(tree)
         tokens = sorted((w for w in saf_article['tokens']
                          if w['sentence'] == sid),
                         key=lambda token: int(token['offset']))
-        sent = call_semafor(conll)
         if "error" in sent:
-            err = {"module": module, "sentence": sid}
+            err = {"module": provenance['module'], "sentence": sid}
             err.update(sent)
             saf_article.setdefault('errors', []).append(err)
             continue
@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from functools import partial
 import json
 import os
 import os.path
-import urllib2
+
+from .._http import call_service, request
 
 
 __all__ = ['Client']
@@ -40,11 +42,11 @@ class Client(object):
         self.url = url
 
     def _call(self, method, text):
-        """Call REST method."""
+        """Call REST method, through the shared HTTP connections and cache."""
         url = os.path.join(self.url, method)
-        req = urllib2.Request(url)
-        response = urllib2.urlopen(req, json.dumps(text)).read()
-        return json.loads(response)
+        send = partial(request, 'POST', url, body=json.dumps(text),
+                       headers={'Content-Type': 'application/json'})
+        return call_service('semanticizest', None, text, {'url': url}, send)
 
     def all_candidates(self, sentence):
         ''' Given a sentence, generate a list of candidate entity links.
@@ -18,11 +18,12 @@ import logging
 import operator
 import os
 import os.path
-from subprocess import Popen, PIPE
+import threading
 
 import nltk
 
 from .._downloader import download_zip
+from .._process import ManagedProcess, process_pool
 
 
 logger = logging.getLogger(__name__)
@@ -32,16 +33,50 @@ _STANFORD_NER = (
     '''http://nlp.stanford.edu/software/stanford-ner-2014-01-04.zip'''
 )
 
+_classpath = None
+_model = None
+_init_lock = threading.Lock()
 
-# Download and start server at import, not call time. Import is done lazily.
-_ner_dir = download_zip(_STANFORD_NER, name="Stanford NER",
-                       check_dir="stanford-ner-2014-01-04")
-_jar = os.path.join(_ner_dir, 'stanford-ner.jar')
-_model = os.path.join(_ner_dir,
-                     'classifiers/english.all.3class.distsim.crf.ser.gz')
-_classpath = '%s:%s' % (_jar, os.path.dirname(__file__))
-_server = Popen(['java', '-mx1000m', '-cp', _classpath, 'NERServer', _model],
-                stdin=PIPE, stdout=PIPE)
+
+def _initialize():
+    """Download Stanford NER on first use."""
+    global _classpath, _model
+    with _init_lock:
+        if _model is not None:
+            return
+        ner_dir = download_zip(_STANFORD_NER, name="Stanford NER",
+                               check_dir="stanford-ner-2014-01-04")
+        jar = os.path.join(ner_dir, 'stanford-ner.jar')
+        _classpath = '%s:%s' % (jar, os.path.dirname(__file__))
+        _model = os.path.join(
+            ner_dir, 'classifiers/english.all.3class.distsim.crf.ser.gz')
+
+
+class _NERServer(ManagedProcess):
+    """NERServer process (see NERServer.java), tagging one line at a time."""
+
+    name = "stanford_ner"
+
+    def command(self):
+        _initialize()
+        return ['java', '-mx1000m', '-cp', _classpath, 'NERServer', _model]
+
+    def tag_lines(self, lines):
+        """Tag lines of text; returns a line of tagged tokens for each."""
+        return self.request(lines)
+
+    def size(self, lines):
+        return len(lines)
+
+    def communicate(self, lines):
+        data = ''.join(line + '\n' for line in lines)
+        out = []
+        self.exchange_lines(data, lambda: len(out) == len(lines),
+                            out.append)
+        return out
+
+
+_pool = process_pool(_NERServer, 'stanford_ner')
 
 
 def tag(doc, format):
@@ -49,17 +84,29 @@ def tag(doc, format):
 
     Expects doc to be a string; for format and return value, see public API.
     """
+    tagged, = tag_many([doc], format)
+    return tagged
+
+
+def tag_many(docs, format):
+    """Implementation of tasks.single.stanford_ner_tag_many.
+
+    Sends all documents to a single NER server before reading the results.
+    """
     if format not in ["tokens", "names"]:
         raise ValueError("unknown format %r" % format)
 
-    toks = nltk.word_tokenize(doc)
-    text = u' '.join(toks).encode('utf-8')
+    lines = [u' '.join(nltk.word_tokenize(doc)).encode('utf-8')
+             for doc in docs]
+    if not lines:
+        return []
+    with _pool.checkout() as server:
+        out = server.tag_lines(lines)
+    return [_convert(tagged, format) for tagged in out]
 
-    _server.stdin.write(text)
-    _server.stdin.write('\n')
 
-    tagged = [token.rsplit('/', 1)
-              for token in _server.stdout.readline().split()]
+def _convert(line, format):
+    tagged = [token.rsplit('/', 1) for token in line.split()]
 
     if format == "tokens":
         return tagged
@@ -3,12 +3,12 @@
 # Copyright 2011-2013 University of Amsterdam
 # Author: Lars Buitinck
 
-from collections import defaultdict
-from heapq import nlargest
+from itertools import chain, islice
+import json
 import logging
+import os
 import numpy as np
-
-from .logsum import logsum
+import scipy.sparse as sp
 
 
 logger = logging.getLogger(__name__)
@@ -21,6 +21,10 @@ class ParsimoniousLM(object):
     method can then be used to fit document-specific models, also for unseen
     documents (with the same vocabulary as the background corpus).
 
+    The background model can be extended with more documents through update,
+    or with the counts of another model through merge, so that it can be
+    built from a stream of documents or in parallel.
+
     Parameters
     ----------
     documents : iterable over iterable over terms
@@ -33,6 +37,10 @@ class ParsimoniousLM(object):
     ----------
     vocab : dict of term -> int
         Mapping of terms to numeric indices
+    terms : array of object
+        Terms, by numeric index (the reverse of vocab)
+    cf : array of float
+        Corpus frequencies of terms
     p_corpus : array of float
         Log prob of terms
     """
@@ -41,19 +49,67 @@ class ParsimoniousLM(object):
         logger.info('Building corpus model')
 
         self.w = w
-        self.vocab = vocab = {}     # Vocabulary: maps terms to numeric indices
-        count = defaultdict(int)    # Corpus frequency
+        self.thresh = thresh
+        self.vocab = {}     # Vocabulary: maps terms to numeric indices
+        self.terms = np.empty(0, dtype=object)
+        self.cf = np.zeros(0)
+
+        self.update(documents)
 
-        for d in documents:
-            for tok in d:
-                i = vocab.setdefault(tok, len(vocab))
-                count[i] += 1
+    def update(self, documents, batch_size=10000):
+        '''Add documents to the background model.
 
-        cf = np.empty(len(count), dtype=np.float)
-        for i, f in count.iteritems():
-            cf[i] = f
-        rare = (cf < thresh)
-        cf -= rare * cf
+        Terms not yet in the vocabulary are added to it. documents are
+        counted batch_size at a time, so they may be a stream (e.g., an
+        Elasticsearch scan) that does not fit in memory.
+        '''
+        documents = iter(documents)
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                break
+            self._add_counts(self._term_ids(chain.from_iterable(batch)))
+        self._fit()
+
+    def merge(self, other):
+        '''Add the term counts of another model to this one.
+
+        Use this to combine models built from parts of a corpus, e.g., by
+        several workers.
+        '''
+        self._add_counts(self._term_ids(other.terms), other.cf)
+        self._fit()
+
+    def _term_ids(self, terms):
+        """Indices of terms, adding new terms to the vocabulary."""
+        vocab = self.vocab
+        new_terms = []
+        ids = []
+        for t in terms:
+            i = vocab.get(t)
+            if i is None:
+                i = vocab[t] = len(vocab)
+                new_terms.append(t)
+            ids.append(i)
+
+        if new_terms:
+            self.terms = np.concatenate([self.terms,
+                                         _object_array(new_terms)])
+        return np.asarray(ids, dtype=np.intp)
+
+    def _add_counts(self, ids, weights=None):
+        counts = np.bincount(ids, weights, minlength=len(self.vocab))
+        if len(self.cf) < len(counts):
+            cf = np.zeros(len(counts))
+            cf[:len(self.cf)] = self.cf
+            self.cf = cf
+        # Not in place: cf may be a read-only memmap from load.
+        self.cf = self.cf + counts
+
+    def _fit(self):
+        cf = self.cf
+        rare = (cf < self.thresh)
+        cf = cf - rare * cf
 
         try:
             old_error_settings = np.seterr(divide='ignore')
@@ -63,6 +119,50 @@ class ParsimoniousLM(object):
         finally:
             np.seterr(**old_error_settings)
 
+    def save(self, path):
+        '''Store the background model in the directory path.
+
+        The vocabulary and parameters go in a JSON file, cf and p_corpus in
+        .npy files, so that they can be memory-mapped by load.
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        _write(os.path.join(path, 'cf.npy'), lambda f: np.save(f, self.cf))
+        _write(os.path.join(path, 'p_corpus.npy'),
+               lambda f: np.save(f, self.p_corpus))
+        params = {'w': self.w, 'thresh': self.thresh,
+                  'terms': list(self.terms)}
+        _write(os.path.join(path, 'model.json'),
+               lambda f: json.dump(params, f))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        '''Load a background model stored by save.
+
+        Parameters
+        ----------
+        path : string
+            Directory the model was stored in.
+        mmap_mode : string, optional
+            Passed to np.load; by default, cf and p_corpus are
+            memory-mapped read-only, so that processes share them.
+        '''
+        with open(os.path.join(path, 'model.json')) as f:
+            params = json.load(f)
+
+        model = cls.__new__(cls)
+        model.w = params['w']
+        model.thresh = params['thresh']
+        model.terms = _object_array(params['terms'])
+        model.vocab = dict((t, i) for i, t in enumerate(params['terms']))
+        model.cf = np.load(os.path.join(path, 'cf.npy'), mmap_mode=mmap_mode)
+        model.p_corpus = np.load(os.path.join(path, 'p_corpus.npy'),
+                                 mmap_mode=mmap_mode)
+        if not len(model.terms) == len(model.cf) == len(model.p_corpus):
+            raise ValueError("vocabulary and counts in %r have different"
+                             " sizes" % path)
+        return model
+
     def top(self, k, d, max_iter=50, eps=1e-5, w=None):
         '''Get the top k terms of a document d and their log probabilities.
 
@@ -81,95 +181,215 @@ class ParsimoniousLM(object):
         Returns
         -------
         t_p : list of (str, float)
+            Terms with equal probabilities are ordered by their index in the
+            vocabulary. If d has fewer than k distinct terms, the list is
+            padded with terms that have probability zero.
         '''
 
-        tf, p_term = self._document_model(d)
-        p_term = self._EM(tf, p_term, w, max_iter, eps)
+        return self.top_many(k, [d], max_iter, eps, w)[0]
 
-        terms = [(t, p_term[i]) for t, i in self.vocab.iteritems()]
-        return nlargest(k, terms, lambda tp: tp[1])
+    def top_many(self, k, docs, max_iter=50, eps=1e-5, w=None, n_jobs=1,
+                 batch_size=1000):
+        '''Get the top k terms and their log probabilities for each of docs.
 
-    def _document_model(self, d):
-        '''Build document model.
+        Like top, but runs EM for all documents at once, which is much
+        faster for many documents.
 
         Parameters
         ----------
-        d : array of terms
+        docs : iterable over iterable over terms
+        max_iter : int, optional
+            Maximum number of iterations of EM algorithm to run.
+        eps : float, optional
+            Convergence threshold for EM algorithm.
+        w : float, optional
+            Weight of document model; overrides value given to __init__
+        n_jobs : integer, optional
+            Number of processes to run EM in, each handling batches of
+            batch_size documents. Large arrays, such as p_corpus, are
+            passed to the processes as read-only memory maps instead of
+            being copied. The results are the same as with n_jobs=1.
 
         Returns
         -------
-        tf : array of int
-            Term frequencies
-        p_term : array of float
-            Term log probabilities
-
-        Initial p_term is 1/n_distinct for terms with non-zero tf,
-        0 for terms with 0 tf.
+        t_p : list of list of (str, float)
         '''
 
-        logger.info('Gathering term probabilities')
-
-        tf = np.zeros(len(self.vocab), dtype=np.float)  # Term frequency
+        if w is None:
+            w = self.w
 
-        for tok in d:
-            tf[self.vocab[tok]] += 1
+        tf = self._document_models(docs)
+        n_docs = tf.shape[0]
+        if n_jobs == 1 or n_docs <= batch_size:
+            p_term = _EM(self.p_corpus, tf, w, max_iter, eps)
+        else:
+            from sklearn.externals.joblib import Parallel, delayed
 
-        n_distinct = (tf > 0).sum()
+            batches = (tf[i:i + batch_size]
+                       for i in xrange(0, n_docs, batch_size))
+            p_term = Parallel(n_jobs=n_jobs)(
+                delayed(_EM)(self.p_corpus, batch, w, max_iter, eps)
+                for batch in batches)
+            p_term = np.concatenate(p_term)
 
-        try:
-            old_error_settings = np.seterr(divide='ignore')
-            p_term = np.log(tf > 0) - np.log(n_distinct)
-        finally:
-            np.seterr(**old_error_settings)
+        indptr = tf.indptr
+        return [_top_k(k, tf.indices[start:end], p_term[start:end],
+                       self.terms)
+                for start, end in zip(indptr[:-1], indptr[1:])]
 
-        return tf, p_term
+    def _document_models(self, docs):
+        '''Build document models.
 
-    def _EM(self, tf, p_term, w, max_iter, eps):
-        '''Expectation maximization.
+        Only the terms that occur in each document are represented, so the
+        cost does not depend on the size of the vocabulary.
 
         Parameters
         ----------
-        tf : array of float
-            Term frequencies, as returned by document_model
-        p_term : array of float
-            Term probabilities, as returned by document_model
-        max_iter : int
-            Number of iterations to run.
+        docs : iterable over iterable over terms
 
         Returns
         -------
-        p_term : array of float
-            A posteriori term probabilities.
+        tf : scipy.sparse.csr_matrix
+            Term frequencies, one row per document, with sorted indices
         '''
 
-        logger.info('EM with max_iter=%d, eps=%g' % (max_iter, eps))
+        logger.info('Gathering term probabilities')
 
-        if w is None:
-            w = self.w
-        w_ = np.log(1 - w)
-        w = np.log(w)
+        vocab = self.vocab
+        indices = []
+        indptr = [0]
+        for d in docs:
+            indices.extend(vocab[tok] for tok in d)
+            indptr.append(len(indices))
 
-        p_corpus = self.p_corpus + w_
-        tf = np.log(tf)
+        tf = sp.csr_matrix((np.ones(len(indices)),
+                            np.asarray(indices, dtype=np.intp), indptr),
+                           shape=(len(indptr) - 1, len(vocab)))
+        tf.sum_duplicates()
+        return tf
 
-        try:
-            old_error_settings = np.seterr(divide='ignore')
-            p_term = np.asarray(p_term)
-            for i in xrange(1, max_iter + 1):
-                # E-step
-                p_term += w
-                E = tf + p_term - np.logaddexp(p_corpus, p_term)
-
-                # M-step
-                new_p_term = E - logsum(E)
-
-                diff = new_p_term - p_term
-                p_term = new_p_term
-                if (diff < eps).all():
-                    logger.info('EM: convergence reached after %d iterations'
-                                % i)
-                    break
-        finally:
-            np.seterr(**old_error_settings)
 
-        return p_term
+def _EM(p_corpus, tf, w, max_iter, eps):
+    '''Expectation maximization, for all documents at once.
+
+    Documents that have converged are dropped from further iterations.
+
+    Parameters
+    ----------
+    p_corpus : array of float
+        Corpus model (log probabilities of terms)
+    tf : scipy.sparse.csr_matrix
+        Term frequencies, as returned by
+        ParsimoniousLM._document_models
+    w : float
+        Weight of document model
+    max_iter : int
+        Number of iterations to run.
+    eps : float
+        A document has converged when none of its term log probabilities
+        changes by eps or more in an iteration.
+
+    Returns
+    -------
+    p_term : array of float
+        A posteriori term log probabilities, aligned with tf.data.
+    '''
+
+    logger.info('EM with max_iter=%d, eps=%g' % (max_iter, eps))
+
+    w_ = np.log(1 - w)
+    w = np.log(w)
+
+    p_result = np.empty(tf.nnz)
+
+    # State for the documents that have not converged: their lengths
+    # (number of distinct terms), positions of their terms in
+    # tf.data, and per term, log tf, corpus and document log probs.
+    lengths = np.diff(tf.indptr)
+    lengths = lengths[lengths > 0]
+    pos = np.arange(tf.nnz)
+    log_tf = np.log(tf.data)
+    p_corpus = p_corpus[tf.indices] + w_
+
+    # Initial p_term is 1/n_distinct.
+    p_term = np.repeat(-np.log(lengths), lengths)
+
+    n_docs = len(lengths)
+    i = 0
+    while i < max_iter and len(lengths) > 0:
+        i += 1
+        starts = np.cumsum(lengths) - lengths
+
+        # E-step
+        p_weighted = p_term + w
+        E = log_tf + p_weighted - np.logaddexp(p_corpus, p_weighted)
+
+        # M-step
+        new_p_term = E - np.repeat(_logsum_rows(E, starts, lengths),
+                                   lengths)
+
+        diff = new_p_term - p_term
+        p_term = new_p_term
+
+        done = np.logical_and.reduceat(np.abs(diff) < eps, starts)
+        if done.any():
+            finished = np.repeat(done, lengths)
+            p_result[pos[finished]] = p_term[finished]
+            active = ~finished
+            lengths = lengths[~done]
+            pos = pos[active]
+            log_tf = log_tf[active]
+            p_corpus = p_corpus[active]
+            p_term = p_term[active]
+
+    logger.info('EM: %d of %d documents converged after %d iterations'
+                % (n_docs - len(lengths), n_docs, i))
+    p_result[pos] = p_term
+    return p_result
+
+
+def _object_array(items):
+    a = np.empty(len(items), dtype=object)
+    for i, x in enumerate(items):
+        a[i] = x
+    return a
+
+
+def _write(path, write):
+    """Write a file through write(f), atomically replacing path."""
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.rename(tmp, path)
+
+
+def _logsum_rows(x, starts, lengths):
+    """logsum of each of the segments of x that begin at starts."""
+    vmax = np.maximum.reduceat(x, starts)
+    out = np.log(np.add.reduceat(np.exp(x - np.repeat(vmax, lengths)),
+                                 starts))
+    out += vmax
+    return out
+
+
+def _top_k(k, indices, p_term, terms):
+    """Top k of indices (into terms) by p_term, as (term, p) pairs.
+
+    Pads with terms that have probability zero if there are fewer than k.
+    """
+    if k < len(indices):
+        # Everything that ties with the k'th most probable term, then break
+        # ties on the term index.
+        kth = p_term[np.argpartition(-p_term, k - 1)[k - 1]]
+        candidates = np.flatnonzero(p_term >= kth)
+    else:
+        candidates = np.arange(len(indices))
+    candidates = candidates[np.lexsort((indices[candidates],
+                                        -p_term[candidates]))][:k]
+    top = zip(terms[indices[candidates]], p_term[candidates])
+
+    if len(top) < k:
+        present = set(indices)
+        absent = (i for i in xrange(len(terms)) if i not in present)
+        top.extend((terms[i], -np.inf) for i in islice(absent, k - len(top)))
+    return top
@@ -20,12 +20,19 @@ These tasks process batches of documents, denoted as lists of strings.
 from __future__ import absolute_import
 
 import operator
+import os.path
+import shutil
+from tempfile import mkdtemp
 
 import cytoolz as toolz
+import numpy as np
+from scipy.sparse import csr_matrix
 from six import itervalues
 
-from .es import fetch
+from .es import fetch_batches
 from ..core import app
+from .._downloader import make_data_home
+from .._pool import parse_memory
 from .._utils import tosequence
 
 
@@ -43,6 +50,10 @@ def _vectorizer(**kwargs):
     return TfidfVectorizer(**kwargs)
 
 
+# Number of documents kmeans fetches at a time.
+_FETCH_BATCH_SIZE = 1000
+
+
 def _group_clusters(docs, labels):
     """Group docs by their cluster labels."""
     return [zip(*cluster)[1]
@@ -89,23 +100,29 @@ def kmeans(docs, k, lsa=None):
         kmeans = make_pipeline(_vectorizer(),
                                MiniBatchKMeans(n_clusters=k))
 
-    labels = kmeans.fit(fetch(d) for d in docs).steps[-1][1].labels_
+    contents = toolz.concat(fetch_batches(docs, _FETCH_BATCH_SIZE))
+    labels = kmeans.fit(contents).steps[-1][1].labels_
     return _group_clusters(docs, labels)
 
 
 @app.task
 def big_kmeans(docs, k, batch_size=1000, n_features=(2 ** 20),
-               single_pass=True):
+               single_pass=True, cache_memory=None):
     """k-means for very large sets of documents.
 
     See kmeans for documentation. Differs from that function in that it does
     not computer tf-idf or LSA, and fetches the documents in a streaming
     fashion, so they don't need to be held in memory. It does not do random
-    restarts.
+    restarts. The next batches of documents are fetched in the background
+    while a batch is being clustered.
 
     If the option single_pass is set to False, the documents are visited
     twice: once to fit a k-means model, once to determine their label in
-    this model.
+    this model. With cache_memory set, the second pass does not fetch and
+    vectorize the documents again, but reuses their vectors from the first
+    pass. These are kept in memory up to cache_memory (a number of bytes,
+    or a size such as "2G"); the rest is written to memory-mapped files in
+    a temporary directory. cache_memory=0 puts all vectors on disk.
     """
     from sklearn.cluster import MiniBatchKMeans
     from sklearn.feature_extraction.text import HashingVectorizer
@@ -116,23 +133,78 @@ def big_kmeans(docs, k, batch_size=1000, n_features=(2 ** 20),
                                    n_features=n_features, norm="l2")
     kmeans = MiniBatchKMeans(n_clusters=k)
 
-    labels = []
-    for batch in toolz.partition_all(batch_size, docs):
-        batch = map(fetch, batch)
-        batch = vectorizer.transform(batch)
-        y = kmeans.fit_predict(batch)
-        if single_pass:
-            labels.extend(y.tolist())
-
-    if not single_pass:
-        for batch in toolz.partition_all(batch_size, docs):
-            batch = map(fetch, batch)
+    cache = None
+    if not single_pass and cache_memory is not None:
+        cache = _VectorCache(cache_memory)
+
+    try:
+        labels = []
+        for batch in fetch_batches(docs, batch_size):
             batch = vectorizer.transform(batch)
-            labels.extend(kmeans.predict(batch).tolist())
+            y = kmeans.fit_predict(batch)
+            if single_pass:
+                labels.extend(y.tolist())
+            elif cache is not None:
+                cache.append(batch)
+
+        if not single_pass:
+            if cache is not None:
+                batches = iter(cache)
+            else:
+                batches = (vectorizer.transform(batch)
+                           for batch in fetch_batches(docs, batch_size))
+            for batch in batches:
+                labels.extend(kmeans.predict(batch).tolist())
+    finally:
+        if cache is not None:
+            cache.close()
 
     return _group_clusters(docs, labels)
 
 
+class _VectorCache(object):
+    """Sequence of sparse matrices, kept in memory up to a budget.
+
+    Matrices that don't fit are stored as .npy files in a temporary
+    directory and memory-mapped when read back.
+    """
+
+    def __init__(self, memory):
+        self.budget = parse_memory(memory)
+        self.used = 0
+        self._batches = []      # csr_matrix, or (shape, filename prefix)
+        self._dir = None
+
+    def append(self, X):
+        X = X.tocsr()
+        size = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+        if self.used + size <= self.budget:
+            self.used += size
+            self._batches.append(X)
+            return
+
+        if self._dir is None:
+            self._dir = mkdtemp(prefix='xtas-kmeans-')
+        prefix = os.path.join(self._dir, str(len(self._batches)))
+        for part in ('data', 'indices', 'indptr'):
+            np.save('%s-%s.npy' % (prefix, part), getattr(X, part))
+        self._batches.append((X.shape, prefix))
+
+    def __iter__(self):
+        for batch in self._batches:
+            if isinstance(batch, tuple):
+                shape, prefix = batch
+                parts = [np.load('%s-%s.npy' % (prefix, part), mmap_mode='r')
+                         for part in ('data', 'indices', 'indptr')]
+                batch = csr_matrix(tuple(parts), shape=shape, copy=False)
+            yield batch
+
+    def close(self):
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+
 @app.task
 def lsa(docs, k, random_state=None):
     """Latent semantic analysis.
@@ -189,7 +261,7 @@ def lda(docs, k, random_state=None):
 
 
 @app.task
-def parsimonious_wordcloud(docs, w=.5, k=10):
+def parsimonious_wordcloud(docs, w=.5, k=10, n_jobs=1, background=None):
     """Fit parsimonious language models to docs.
 
     A parsimonious language model shows which words "stand out" in each
@@ -197,7 +269,8 @@ def parsimonious_wordcloud(docs, w=.5, k=10):
     might want to display in a word cloud.
 
     This function fits a background model to all of docs, then fits individual
-    models to each document in turn using the background model.
+    models to each document in turn using the background model. Alternatively,
+    a background model stored by parsimonious_background can be used.
 
     Parameters
     ----------
@@ -212,6 +285,17 @@ def parsimonious_wordcloud(docs, w=.5, k=10):
     k : integer
         Number of terms to return per document.
 
+    n_jobs : integer, optional
+        Number of processes to fit the individual models in. A large
+        background model is shared with these processes through a memory
+        map rather than copied. Inside a Celery worker that doesn't allow
+        subprocesses, the models are fitted sequentially.
+
+    background : string, optional
+        Name of a background model stored by parsimonious_background, to
+        compare docs against instead of the full set. Terms that do not
+        occur in the background model are ignored.
+
     Returns
     -------
     terms : list of list of (string, float)
@@ -220,5 +304,86 @@ def parsimonious_wordcloud(docs, w=.5, k=10):
     """
     from ._weighwords import ParsimoniousLM
 
-    model = ParsimoniousLM(docs, w=w)
-    return [model.top(k, d) for d in docs]
+    if background is None:
+        model = ParsimoniousLM(docs, w=w)
+    else:
+        model = _background_model(background)
+        vocab = model.vocab
+        docs = [[t for t in d if t in vocab] for d in docs]
+    return model.top_many(k, docs, w=w, n_jobs=n_jobs)
+
+
+@app.task
+def parsimonious_background(docs, name, thresh=0, update=False):
+    """Fit a background model for parsimonious language models and store it.
+
+    The model is stored in the xtas data directory under name, and can then
+    be passed to parsimonious_wordcloud as its background argument. Any
+    model by that name is replaced, or, with update=True, extended with the
+    terms in docs, so that a model can be built from batches of documents.
+    Updates are not atomic: concurrent update=True tasks on the same name
+    lose each other's counts. To build a model in parallel, store partial
+    models under separate names and combine them with ParsimoniousLM.merge.
+
+    Its term probabilities are memory-mapped when used, so large models are
+    cheap to load and shared by worker processes on the same machine.
+    Workers on other machines only see the model if $XTAS_DATA is on a
+    shared filesystem.
+
+    Parameters
+    ----------
+    docs : list
+        List of documents. Each document should be a list of terms.
+
+    name : string
+        Name of the model.
+
+    thresh : integer
+        Ignore terms that occur fewer than thresh times in docs.
+
+    update : boolean
+        Add docs to the stored model instead of replacing it.
+
+    Returns
+    -------
+    name : string
+        The name of the model.
+    """
+    from ._weighwords import ParsimoniousLM
+
+    path = _background_path(name)
+    if update and os.path.exists(path):
+        model = ParsimoniousLM.load(path)
+        model.thresh = thresh
+        model.update(docs)
+    else:
+        # w is given to parsimonious_wordcloud when using the model.
+        model = ParsimoniousLM(docs, w=.5, thresh=thresh)
+    model.save(path)
+    return name
+
+
+def _background_path(name):
+    if not name or os.path.sep in name or name.startswith('.'):
+        raise ValueError("invalid model name %r" % name)
+    return os.path.join(make_data_home('parsimonious'), name)
+
+
+_BACKGROUND_MODELS = {}
+
+
+def _background_model(name):
+    """Load a stored background model, caching it per worker process."""
+    from ._weighwords import ParsimoniousLM
+
+    path = _background_path(name)
+    try:
+        mtime = os.path.getmtime(os.path.join(path, 'model.json'))
+    except OSError:
+        raise ValueError("no background model named %r" % name)
+
+    cached = _BACKGROUND_MODELS.get(name)
+    if cached is None or cached[0] != mtime:
+        cached = _BACKGROUND_MODELS[name] = (mtime,
+                                             ParsimoniousLM.load(path))
+    return cached[1]
@@ -16,10 +16,14 @@
 
 from __future__ import absolute_import
 from datetime import datetime
+from Queue import Full, Queue
+import sys
+import threading
 
+from cytoolz import partition_all
 from elasticsearch import Elasticsearch, client, exceptions
 from elasticsearch.helpers import scan
-from six import iteritems
+from six import iteritems, reraise
 
 from chardet import detect as chardetect
 
@@ -109,6 +113,101 @@ def fetch(doc):
                         % type(doc))
 
 
+def fetch_many(docs):
+    """Fetch many documents (if necessary).
+
+    Like fetch, but fetches all the Elasticsearch documents among docs in
+    a single multi-get request.
+
+    Parameters
+    ----------
+    docs : list of {dict, string}
+        Handles returned by es_document, or plain strings.
+
+    Returns
+    -------
+    contents : list of string
+        Contents of the documents, in the order of docs.
+    """
+    contents = list(docs)
+    es_docs = [(i, es_address(doc)) for i, doc in enumerate(contents)
+               if is_es_document(doc)]
+    for i, doc in enumerate(contents):
+        if not is_es_document(doc):
+            contents[i] = fetch(doc)
+
+    if es_docs:
+        body = {'docs': [{'_index': idx, '_type': typ, '_id': id,
+                          '_source': [field]}
+                         for _, (idx, typ, id, field) in es_docs]}
+        hits = _es().mget(body=body)['docs']
+        for (i, (idx, typ, id, field)), hit in zip(es_docs, hits):
+            if not hit.get('found'):
+                raise exceptions.NotFoundError(
+                    404, "document %s/%s/%s not found" % (idx, typ, id))
+            contents[i] = hit['_source'][field]
+    return contents
+
+
+def fetch_batches(docs, batch_size, prefetch=2):
+    """Fetch documents in batches, on a background thread.
+
+    While the caller processes a batch, up to prefetch next batches are
+    fetched (see fetch_many), so that fetching and processing overlap.
+
+    Parameters
+    ----------
+    docs : iterable of {dict, string}
+        Handles returned by es_document, or plain strings.
+    batch_size : integer
+        Number of documents per batch.
+    prefetch : integer, optional
+        Maximum number of batches fetched ahead.
+
+    Returns
+    -------
+    batches : iterator over list of string
+        Contents of the documents, batch_size at a time.
+    """
+    queue = Queue(maxsize=prefetch)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up when the consumer has gone away.
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in partition_all(batch_size, docs):
+                if not put((fetch_many(batch), None)):
+                    return
+        except Exception:
+            put((None, sys.exc_info()))
+        else:
+            put((done, None))
+
+    fetcher = threading.Thread(target=produce)
+    fetcher.daemon = True
+    fetcher.start()
+    try:
+        while True:
+            batch, exc_info = queue.get()
+            if exc_info is not None:
+                reraise(*exc_info)
+            if batch is done:
+                return
+            yield batch
+    finally:
+        stopped.set()
+
+
 @app.task
 def fetch_query_batch(idx, typ, query, field='body'):
     """Fetch all documents matching query and return them as a list.
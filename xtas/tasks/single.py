@@ -23,17 +23,17 @@ document in an Elasticsearch store.
 
 from __future__ import absolute_import
 
-import json
-from urllib import urlencode
-from urllib2 import urlopen
+from functools import partial
 
-from cytoolz import identity, pipe
+from cytoolz import concat, identity, partition_all, pipe
 import nltk
 import spotlight
 
 from .es import fetch
 from ..core import app
-from .._utils import nltk_download
+from .._http import call_service, form_request, map_concurrent
+from .._http import request as http_request
+from .._utils import nltk_download, tosequence
 
 
 @app.task
@@ -91,12 +91,36 @@ def heideltime(doc, language='english', output='values'):
 
         When ``output == "values"`` (the default), only the values of the
         previously described dicts are returned.
+
+    Heideltime is kept running between calls. To run several Heideltime
+    processes per worker, set the environment variable
+    ``XTAS_HEIDELTIME_POOL_SIZE``.
+
+    Unless xtas was installed with a precompiled HeidelTimeServer.class,
+    the first call compiles it, which requires a Java Development Kit
+    (javac) on the worker.
+
+    See also
+    --------
+    heideltime_many: tag a batch of documents.
     """
     from ._heideltime import call_heideltime
 
     return call_heideltime(fetch(doc), language, output)
 
 
+@app.task
+def heideltime_many(docs, language='english', output='values'):
+    """Runs the Heideltime temporal tagger on each of the documents in docs.
+
+    Returns a list with one result per document. See heideltime for the
+    parameters.
+    """
+    from ._heideltime import call_heideltime_many
+
+    return call_heideltime_many(map(fetch, docs), language, output)
+
+
 @app.task
 def morphy(doc):
     """Lemmatize tokens using morphy, WordNet's lemmatizer.
@@ -256,14 +280,30 @@ def stanford_ner_tag(doc, output="tokens"):
     tagged : list of list of pair of string
         For each sentence, a list of (word, tag) pairs.
 
+    The NER server is started on first use and kept running. To run several
+    servers per worker, set the environment variable
+    ``XTAS_STANFORD_NER_POOL_SIZE``.
+
     See also
     --------
     nlner_conll: NER tagger for Dutch.
+    stanford_ner_tag_many: tag a batch of documents.
     """
     from ._stanford_ner import tag
     return tag(fetch(doc), output)
 
 
+@app.task
+def stanford_ner_tag_many(docs, output="tokens"):
+    """Named entity recognizer using Stanford NER, for many documents.
+
+    Sends all documents to the NER server in one round trip. Returns a list
+    with the result of stanford_ner_tag for each document.
+    """
+    from ._stanford_ner import tag_many
+    return tag_many(map(fetch, docs), output)
+
+
 @app.task
 def pos_tag(tokens, model='nltk'):
     """Perform part-of-speech (POS) tagging for English.
@@ -283,8 +323,72 @@ def pos_tag(tokens, model='nltk'):
     """
     if model != 'nltk':
         raise ValueError("unknown POS tagger %r" % model)
-    nltk_download('averaged_perceptron_tagger')
-    return nltk.pos_tag(tokens)
+    return _pos_tagger().tag(tokens)
+
+
+@app.task
+def pos_tag_many(docs, model='nltk', n_jobs=1, batch_size=1000):
+    """Perform part-of-speech (POS) tagging for English on many documents.
+
+    Batch version of pos_tag. The tagger model is loaded once per worker
+    process, so this is much faster than calling pos_tag for every sentence.
+
+    Parameters
+    ----------
+    docs : list
+        Each element is either a list of tokens (e.g., a sentence), or a
+        document, which will be tokenized first.
+    model : string
+        Name of tagger model to use. Currently only accepts 'nltk'.
+    n_jobs : integer, optional
+        Number of processes to tag with. Only used when there are more than
+        batch_size documents. Inside a Celery worker that doesn't allow
+        subprocesses, tagging is done sequentially.
+    batch_size : integer, optional
+        Number of documents handed to a process at a time.
+
+    Returns
+    -------
+    tagged : list of list of (string, string)
+        For each element of docs, a list of (token, pos tag) pairs.
+
+    See also
+    --------
+    pos_tag: tags a single list of tokens.
+    """
+    if model != 'nltk':
+        raise ValueError("unknown POS tagger %r" % model)
+
+    docs = tosequence(docs)
+    if n_jobs == 1 or len(docs) <= batch_size:
+        return _pos_tag_batch(docs)
+
+    from sklearn.externals.joblib import Parallel, delayed
+
+    tagged = Parallel(n_jobs=n_jobs)(delayed(_pos_tag_batch)(batch)
+                                     for batch in partition_all(batch_size,
+                                                                docs))
+    return list(concat(tagged))
+
+
+_POS_TAGGER = None
+
+
+def _pos_tagger():
+    # nltk.pos_tag loads the perceptron model from disk on every call.
+    global _POS_TAGGER
+    if _POS_TAGGER is None:
+        from nltk.tag.perceptron import PerceptronTagger
+        nltk_download('averaged_perceptron_tagger')
+        _POS_TAGGER = PerceptronTagger()
+    return _POS_TAGGER
+
+
+def _pos_tag_batch(docs):
+    tag = _pos_tagger().tag
+    return [tag(d if isinstance(d, (list, tuple))
+                else pipe(d, fetch, tokenize))
+            for d in docs]
 
 
 @app.task
@@ -310,7 +414,7 @@ def semanticizest(doc, location):
         (scores).
     """
     from ._semanticizest import Client
-    return Client().all_candidates(fetch(doc))
+    return Client(location).all_candidates(fetch(doc))
 
 
 
@@ -373,7 +477,7 @@ def tokenize(doc):
 
 
 @app.task
-def semanticize(doc, lang='en'):
+def semanticize(doc, lang='en', api_url=None):
     """Run text through the UvA semanticizer.
 
     Calls the UvA semanticizer webservice to perform entity linking and
@@ -381,6 +485,17 @@ def semanticize(doc, lang='en'):
 
     See http://semanticize.uva.nl/doc/ for details.
 
+    Responses are cached per worker process (see xtas._http), so calling
+    this again on the same text is cheap.
+
+    Parameters
+    ----------
+    doc : document
+    lang : string
+        Language code.
+    api_url : string, optional
+        Base URL of the semanticizer API. Defaults to the UvA service.
+
     References
     ----------
     M. Guerini, L. Gatti and M. Turchi (2013). "Sentiment analysis: How to
@@ -388,12 +503,29 @@ def semanticize(doc, lang='en'):
 
     """
 
+    return _semanticize(doc, lang, api_url)
+
+
+@app.task
+def semanticize_many(docs, lang='en', api_url=None):
+    """Run many documents through the UvA semanticizer.
+
+    The requests for the documents are made concurrently, retrying on
+    errors. Returns a list with the results of semanticize, in the order of
+    docs.
+    """
+    return map_concurrent(partial(_semanticize, lang=lang, api_url=api_url),
+                          docs)
+
+
+def _semanticize(doc, lang, api_url):
     if not lang.isalpha():
         raise ValueError("not a valid language: %r" % lang)
     text = fetch(doc)
-    url = 'http://semanticize.uva.nl/api/%s?%s' % (lang,
-                                                   urlencode({'text': text}))
-    return json.loads(urlopen(url).read())['links']
+    url = '%s/%s' % (api_url or 'http://semanticize.uva.nl/api', lang)
+    response = call_service('semanticize', lang, text, {'url': url},
+                            partial(form_request, url, {'text': text}))
+    return response['links']
 
 
 @app.task
@@ -416,7 +548,15 @@ def frog(doc, output='raw'):
 
     Expects Frog to be running in server mode, listening on
     ``localhost:${XTAS_FROG_PORT}`` or port 9987 if the environment variable
-    ``XTAS_FROG_PORT`` is not set. It is *not* started for you.
+    ``XTAS_FROG_PORT`` is not set. It is *not* started for you. To use
+    several Frog servers, list them in ``XTAS_FROG_HOSTS`` as a
+    comma-separated list of ``host:port``; each document goes to the server
+    with the fewest outstanding requests. Connections to the servers are
+    kept open between calls. At most ``XTAS_FROG_MAX_INFLIGHT`` (default 4)
+    requests per server are sent concurrently by a worker process. Servers
+    that fail are avoided for ``XTAS_FROG_EJECT_TIME`` seconds (default 30).
+    Set ``XTAS_FROG_TIMEOUT`` to fail documents that Frog takes more than
+    that many seconds to process.
 
     Currently, the module is only tested with all frog modules active except
     for the NER and parser.
@@ -465,8 +605,27 @@ def dbpedia_spotlight(doc, lang='en', conf=0.5, supp=0, api_url=None):
     See http://spotlight.dbpedia.org/ for details.
     This task uses a Python client for DBp Spotlight:
     https://github.com/aolieman/pyspotlight
+
+    Responses are cached per worker process (see xtas._http), so calling
+    this again on the same text is cheap.
+    """
+    return _dbpedia_spotlight(doc, lang, conf, supp, api_url)
+
+
+@app.task
+def dbpedia_spotlight_many(docs, lang='en', conf=0.5, supp=0, api_url=None):
+    """Run many documents through a DBpedia Spotlight instance.
+
+    The requests for the documents are made concurrently, retrying on
+    errors. Returns a list with the results of dbpedia_spotlight, in the
+    order of docs.
     """
+    return map_concurrent(partial(_dbpedia_spotlight, lang=lang, conf=conf,
+                                  supp=supp, api_url=api_url),
+                          docs)
 
+
+def _dbpedia_spotlight(doc, lang, conf, supp, api_url):
     if api_url is None:
         server = "http://spotlight.sztaki.hu"
 
@@ -492,12 +651,8 @@ def dbpedia_spotlight(doc, lang='en', conf=0.5, supp=0, api_url=None):
     text = fetch(doc)
 
     try:
-        spotlight_resp = spotlight.candidates(
-            api_url, text,
-            confidence=conf,
-            support=supp,
-            spotter='Default'
-        )
+        spotlight_resp = _spotlight_candidates(api_url, text, lang, conf,
+                                               supp)
     except (spotlight.SpotlightException, TypeError) as e:
         return {'error': e.message}
 
@@ -512,6 +667,29 @@ def dbpedia_spotlight(doc, lang='en', conf=0.5, supp=0, api_url=None):
     return annotations
 
 
+def _spotlight_candidates(api_url, text, lang, conf, supp):
+    """spotlight.candidates, over the shared HTTP connections and cache."""
+    params = {'confidence': conf, 'support': supp, 'spotter': 'Default',
+              'disambiguator': 'Default', 'policy': 'whitelist'}
+    fields = dict(params, text=text)
+    send = partial(http_request, 'POST', api_url, fields=fields,
+                   headers={'Accept': 'application/json'})
+    response = call_service('dbpedia_spotlight', lang, text,
+                            dict(params, url=api_url), send)
+
+    if 'annotation' not in response:
+        raise spotlight.SpotlightException(
+            'No annotations found in spotlight response: %s' % response)
+    forms = response['annotation'].get('surfaceForm')
+    if forms is None:
+        raise spotlight.SpotlightException(
+            'No surface forms found in spotlight response: %s' % response)
+    if not isinstance(forms, list):
+        forms = [forms]
+    # Same clean-up of "@" keys and number conversion as pyspotlight.
+    return [spotlight._dict_cleanup(form) for form in forms]
+
+
 def _output_func(output, saf_func):
     try:
         return {"raw": identity, "saf": saf_func}[output]
@@ -529,6 +707,9 @@ def alpino(doc, output="raw"):
     The script uses the 'dependencies' end_hook to generate lemmata and
     the dependency structure.
 
+    The Alpino parser is kept running between calls. To run several parsers
+    per worker, set the environment variable ``XTAS_ALPINO_POOL_SIZE``.
+
     Parameters
     ----------
     output : string
@@ -547,23 +728,64 @@ def alpino(doc, output="raw"):
 
 
 @app.task
-def corenlp(doc, output='raw'):
+def corenlp(doc, output='raw', annotators=None):
     """Wrapper around the Stanford CoreNLP parser.
 
     CoreNLP is downloaded automatically.
 
     If run with all annotators, it requires around 3G of memory,
-    and it will keep the process in memory indefinitely.
+    and it will keep the process in memory indefinitely. A separate process
+    is started for every set of annotators; processes that don't need the
+    large models for NER, parsing or coreference resolution get a 1G heap.
+
+    To parse several documents concurrently (e.g., with a threaded worker),
+    set the environment variable ``XTAS_CORENLP_POOL_SIZE`` to the number of
+    CoreNLP processes to run, or ``XTAS_CORENLP_MEMORY`` to the total amount
+    of memory they may use (e.g., "12G"). Set ``XTAS_CORENLP_IDLE_TIMEOUT``
+    to stop processes that have not been used for that many seconds.
 
     Parameters
     ----------
     output : string
         If 'raw', returns the raw output lines from CoreNLP.
         If 'saf', returns a SAF dictionary.
+    annotators : list of string or string, optional
+        CoreNLP annotators to run, e.g. "tokenize,ssplit,pos,lemma".
+        Annotators must be listed after the ones they depend on.
+        Defaults to CoreNLP's default set of annotators.
     """
     from ._corenlp import parse, stanford_to_saf
 
-    return pipe(doc, fetch, parse, _output_func(output, stanford_to_saf))
+    return pipe(doc, fetch, partial(parse, annotators=annotators),
+                _output_func(output, stanford_to_saf))
+
+
+@app.task
+def corenlp_many(docs, output='raw', annotators=None):
+    """Run a batch of documents through the Stanford CoreNLP parser.
+
+    Batch version of corenlp. All documents are sent to a single CoreNLP
+    process in one go, which saves a round trip per document.
+
+    Parameters
+    ----------
+    docs : list of documents
+    output : string
+        If 'raw', returns the raw output lines from CoreNLP.
+        If 'saf', returns a SAF dictionary.
+    annotators : list of string or string, optional
+        CoreNLP annotators to run; see corenlp.
+
+    Returns
+    -------
+    results : list
+        One result per document, in the same order.
+    """
+    from ._corenlp import parse_many, stanford_to_saf
+
+    transf = _output_func(output, stanford_to_saf)
+    return [transf(result)
+            for result in parse_many(map(fetch, docs), annotators)]
 
 
 @app.task
@@ -572,25 +794,33 @@ def corenlp_lemmatize(doc, output='raw'):
 
     CoreNLP is downloaded automatically.
 
+    Only runs the tokenizer, sentence splitter, POS tagger and lemmatizer,
+    in a separate CoreNLP process with a 1G heap. This is much faster than
+    running corenlp with all annotators.
+
     Parameters
     ----------
     output : string
         If 'raw', returns the raw output lines from CoreNLP.
         If 'saf', returns a SAF dictionary.
     """
-    from ._corenlp import parse, stanford_to_saf
+    from ._corenlp import LEMMATIZE, parse, stanford_to_saf
 
-    return pipe(doc, fetch, parse, _output_func(output, stanford_to_saf))
+    return pipe(doc, fetch, partial(parse, annotators=LEMMATIZE),
+                _output_func(output, stanford_to_saf))
 
 
 @app.task
 def semafor(saf):
     """Wrapper around the Semafor semantic parser.
 
-    Expects semafor running in server mode listening to
-    ``${SEMAFOR_HOST}:${SEMAFOR_PORT}`` (defaults to localhost:9888).
+    Expects ``$SEMAFOR_HOME`` to point to the Semafor installation dir.
     It also expects ``$CORENLP_HOME`` to point to the CoreNLP installation dir.
 
+    Semafor is kept running between calls. Since it needs 4GB of memory, a
+    single process per worker is started by default; set the environment
+    variable ``XTAS_SEMAFOR_POOL_SIZE`` to run more.
+
     Input is expected to be a 'SAF' dictionary with trees and tokens.
     Output is a SAF dictionary with a frames attribute added.
 
@@ -0,0 +1,53 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-ins for external tools in the managed process tests.
+"""
+
+import os
+import sys
+from tempfile import NamedTemporaryFile
+
+
+class StubCommand(object):
+    """Mixin for ManagedProcess subclasses that runs a Python script instead
+    of the real tool.
+
+    Put it before the ManagedProcess subclass in the bases and set ``stub``
+    to the script's source. Processes with ``shell = True`` get an ``exec``
+    command line, as CoreNLP's does.
+    """
+
+    stub = None
+    _stub = None
+
+    def command(self):
+        self._remove_stub()
+        script = NamedTemporaryFile(suffix='.py', delete=False)
+        with script:
+            script.write(self.stub)
+        self._stub = script.name
+        if self.shell:
+            return 'exec "{}" -u "{}"'.format(sys.executable, script.name)
+        return [sys.executable, '-u', script.name]
+
+    def close(self):
+        super(StubCommand, self).close()
+        self._remove_stub()
+
+    def _remove_stub(self):
+        if self._stub is not None and os.path.exists(self._stub):
+            os.remove(self._stub)
+        self._stub = None
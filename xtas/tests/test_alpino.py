@@ -19,10 +19,17 @@ Test the Alpino parser functions and task.
 import json
 import os
 import os.path
+import shutil
+import stat
+import sys
+import tempfile
+import time
 from unittest import SkipTest
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_less
 
+from xtas._process import process_pool
+from xtas.tasks import _alpino
 from xtas.tasks._alpino import (tokenize, parse_raw,
                                 interpret_token, interpret_parse)
 from xtas.tasks.single import alpino
@@ -105,3 +112,111 @@ def test_alpino_unicode():
     saf = alpino(text, output='saf')
     assert_equal({t['lemma'] for t in saf['tokens']},
                  {u"\xe9\xe9n", "test", "nog"})
+
+
+# Fake Alpino that makes every word a dependent of the first, which is the
+# dependent of the top node. It logs its starts
+# to the file "starts" and dies on the word "crash" unless "crashed" exists.
+# While the file "mute" exists, it prints nothing for the sentence "klaar".
+_STUB = """#!{python}
+import os, sys
+open("starts", "a").write("start\\n")
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    key, sentence = line.rstrip("\\n").split("|", 1)
+    words = sentence.split()
+    if sentence == "klaar" and os.path.exists("mute"):
+        continue
+    for i, word in enumerate(words):
+        if word == "crash" and not os.path.exists("crashed"):
+            open("crashed", "w").close()
+            sys.exit(1)
+        if i == 0:
+            parent = "top|top|0|0|top|top|top|top/hd"
+        else:
+            parent = "%s|%s|0|1|noun|noun|noun(sg)|hd/mod" % (words[0],
+                                                              words[0])
+        sys.stdout.write("%s|%s|%s|%d|%d|noun|noun|noun(sg)|%s\\n"
+                         % (parent, word, word, i, i + 1, key))
+        sys.stdout.flush()
+    sys.stderr.write("parsed %s\\n" % key)
+"""
+
+
+class _FakeAlpino(object):
+    def __enter__(self):
+        self.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.home, 'bin'))
+        path = os.path.join(self.home, 'bin', 'Alpino')
+        with open(path, 'w') as f:
+            f.write(_STUB.format(python=sys.executable))
+        os.chmod(path, stat.S_IRWXU)
+        self.old_home = os.environ.get('ALPINO_HOME')
+        os.environ['ALPINO_HOME'] = self.home
+        self.old_pool = _alpino._pool
+        _alpino._pool = process_pool(_alpino._AlpinoParser, 'alpino')
+        return self
+
+    def __exit__(self, *exc_info):
+        _alpino._pool.close()
+        _alpino._pool = self.old_pool
+        if self.old_home is None:
+            del os.environ['ALPINO_HOME']
+        else:
+            os.environ['ALPINO_HOME'] = self.old_home
+        shutil.rmtree(self.home)
+
+    def starts(self):
+        with open(os.path.join(self.home, 'starts')) as f:
+            return len(f.readlines())
+
+
+def _words(parse):
+    return [(line.split("|")[9], int(line.split("|")[-1]))
+            for line in parse.splitlines()]
+
+
+def test_persistent_parser():
+    with _FakeAlpino() as fake:
+        for i in range(20):
+            parse = parse_raw("Toob is dik\nnummer %d\n" % i)
+            assert_equal(_words(parse), [("Toob", 1), ("is", 1), ("dik", 1),
+                                         ("nummer", 2), (str(i), 2)])
+        assert_equal(fake.starts(), 1)
+
+        saf = interpret_parse(parse_raw("Toob is dik"))
+        assert_equal({t['word'] for t in saf['tokens']}, {"Toob", "is", "dik"})
+        assert_equal(len(saf['dependencies']), 2)
+
+
+def test_parser_respawn():
+    with _FakeAlpino() as fake:
+        parse_raw("eerste zin")
+        # The first attempt kills Alpino, the second one succeeds.
+        assert_equal(_words(parse_raw("crash test")),
+                     [("crash", 1), ("test", 1)])
+        assert_equal(_words(parse_raw("en verder")),
+                     [("en", 1), ("verder", 1)])
+        assert_equal(fake.starts(), 2)
+
+
+def test_silent_sentinel():
+    sentinel_timeout = _alpino._AlpinoParser.sentinel_timeout
+    _alpino._AlpinoParser.sentinel_timeout = .2
+    try:
+        with _FakeAlpino() as fake:
+            open(os.path.join(fake.home, 'mute'), 'w').close()
+            t0 = time.time()
+            assert_equal(_words(parse_raw("Toob is dik\nnog een")),
+                         [("Toob", 1), ("is", 1), ("dik", 1),
+                          ("nog", 2), ("een", 2)])
+            assert_less(time.time() - t0, 5)
+
+            os.remove(os.path.join(fake.home, 'mute'))
+            assert_equal(_words(parse_raw("en verder")),
+                         [("en", 1), ("verder", 1)])
+            assert_equal(fake.starts(), 1)
+    finally:
+        _alpino._AlpinoParser.sentinel_timeout = sentinel_timeout
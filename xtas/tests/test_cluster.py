@@ -1,8 +1,18 @@
 import numbers
+import os
+import shutil
+from tempfile import mkdtemp
 
-from nose.tools import assert_equal, assert_true
+import numpy as np
+import scipy.sparse as sp
+from nose.tools import (assert_almost_equal, assert_equal, assert_raises,
+                        assert_true)
 
-from xtas.tasks.cluster import parsimonious_wordcloud
+from xtas.tasks import cluster
+from xtas.tasks._weighwords import ParsimoniousLM
+from xtas.tasks._weighwords.parsimonious import _EM
+from xtas.tasks.cluster import (big_kmeans, parsimonious_background,
+                                parsimonious_wordcloud)
 
 
 def test_parsimonious_wordcloud():
@@ -17,3 +27,222 @@ def test_parsimonious_wordcloud():
         for term, weight in x:
             assert_true(isinstance(term, basestring))
             assert_true(isinstance(weight, numbers.Real))
+
+
+def test_parsimonious_lm():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the dog sat on the log",
+                                "a cat and a dog"]]
+    model = ParsimoniousLM(docs, w=.5)
+    vocab_size = len(model.vocab)
+
+    top = model.top(vocab_size, docs[0])
+    assert_equal(vocab_size, len(top))
+    p = dict(top)
+    in_doc = np.array([p[t] for t in set(docs[0])])
+    assert_true(np.isfinite(in_doc).all())
+    assert_almost_equal(0, np.logaddexp.reduce(in_doc))
+    assert_true(all(p[t] == -np.inf for t in model.vocab
+                    if t not in docs[0]))
+    # "mat" is rarer than "sat" in the corpus, so it stands out more.
+    assert_true(p["mat"] > p["sat"])
+
+    assert_equal([-np.inf] * 3, [p for _, p in model.top(3, [])])
+
+
+def test_parsimonious_lm_many():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the dog sat on the log",
+                                "a cat and a dog",
+                                "",
+                                "dog dog dog"]]
+    model = ParsimoniousLM(docs, w=.3)
+    for k in [2, 4, len(model.vocab)]:
+        many = model.top_many(k, docs)
+        assert_equal(len(docs), len(many))
+        for d, top in zip(docs, many):
+            assert_equal(k, len(top))
+            expected = dict(model.top(len(model.vocab), d))
+            for term, p in top:
+                assert_almost_equal(expected[term], p)
+            probs = [p for _, p in top]
+            assert_equal(sorted(probs, reverse=True), probs)
+
+
+def _em_reference(p_corpus, tf, w, max_iter, eps):
+    """EM for a single document, one term at a time."""
+    p = np.repeat(-np.log(len(tf)), len(tf))
+    for _ in range(max_iter):
+        E = (np.log(tf) + p + np.log(w)
+             - np.logaddexp(p_corpus + np.log(1 - w), p + np.log(w)))
+        new_p = E - np.logaddexp.reduce(E)
+        diff = new_p - p
+        p = new_p
+        if np.all(np.abs(diff) < eps):
+            break
+    return p
+
+
+def test_parsimonious_lm_converged():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the the the the cat",
+                                "mat log mat log dog",
+                                "a cat and a dog and a mat",
+                                "dog"]]
+    model = ParsimoniousLM(docs, w=.1)
+    tf = model._document_models(docs)
+    p_term = _EM(model.p_corpus, tf, .1, max_iter=200, eps=1e-6)
+
+    # Each document runs until none of its term probabilities moves, in
+    # either direction, or max_iter is reached.
+    for i in range(len(docs)):
+        row = slice(tf.indptr[i], tf.indptr[i + 1])
+        expected = _em_reference(model.p_corpus[tf.indices[row]],
+                                 tf.data[row], .1, 200, 1e-6)
+        assert_true(np.allclose(expected, p_term[row]), docs[i])
+
+
+def test_parsimonious_lm_top_order():
+    docs = [s.split() for s in ["b a c", "a b c d e"]]
+    model = ParsimoniousLM(docs, w=.5)
+    assert_equal(list(model.terms), ["b", "a", "c", "d", "e"])
+    # All terms of docs[0] tie; ties go by index, then padding follows.
+    top = model.top(4, docs[0])
+    assert_equal(["b", "a", "c", "d"], [t for t, _ in top])
+    assert_equal(-np.inf, top[3][1])
+
+
+def test_parsimonious_lm_parallel():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the dog sat on the log",
+                                "a cat and a dog",
+                                "",
+                                "dog dog dog"]] * 5
+    model = ParsimoniousLM(docs, w=.3)
+    assert_equal(model.top_many(3, docs),
+                 model.top_many(3, docs, n_jobs=2, batch_size=4))
+
+
+def test_parsimonious_lm_save_load():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                u"the d\xf6g sat on the log"]]
+    model = ParsimoniousLM(docs, w=.3)
+    tempdir = mkdtemp()
+    try:
+        model.save(os.path.join(tempdir, 'model'))
+        loaded = ParsimoniousLM.load(os.path.join(tempdir, 'model'))
+        assert_true(isinstance(loaded.p_corpus, np.memmap))
+        assert_equal(model.vocab, loaded.vocab)
+        assert_equal(.3, loaded.w)
+        assert_equal(model.top_many(3, docs), loaded.top_many(3, docs))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_parsimonious_background():
+    background = [s.split() for s in ["the cat sat on the mat",
+                                      "the dog sat on the log"]]
+    docs = [s.split() for s in ["the cat ate the fish", "a dog"]]
+    data_home = os.environ.get('XTAS_DATA')
+    os.environ['XTAS_DATA'] = tempdir = mkdtemp()
+    try:
+        assert_equal("pets", parsimonious_background(background, "pets"))
+        clouds = parsimonious_wordcloud(docs, k=2, background="pets")
+        # Terms not in the background model are ignored.
+        assert_equal(["cat", "the"], sorted(t for t, _ in clouds[0]))
+        assert_equal("dog", clouds[1][0][0])
+
+        parsimonious_background([["fish"]], "pets", update=True)
+        clouds = parsimonious_wordcloud(docs, k=3, background="pets")
+        assert_true("fish" in dict(clouds[0]))
+
+        assert_raises(ValueError, parsimonious_wordcloud, docs,
+                      background="nothing")
+        assert_raises(ValueError, parsimonious_background, docs, "../up")
+    finally:
+        shutil.rmtree(tempdir)
+        if data_home is None:
+            del os.environ['XTAS_DATA']
+        else:
+            os.environ['XTAS_DATA'] = data_home
+
+
+def test_parsimonious_lm_update():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the dog sat on the log",
+                                "a cat and a dog",
+                                "dog dog dog"]]
+    model = ParsimoniousLM(docs, w=.3, thresh=2)
+
+    streamed = ParsimoniousLM(iter(docs[:1]), w=.3, thresh=2)
+    streamed.update(iter(docs[1:3]), batch_size=1)
+    streamed.merge(ParsimoniousLM(docs[3:], w=.3))
+
+    assert_equal(model.vocab, streamed.vocab)
+    assert_equal(list(model.cf), list(streamed.cf))
+    assert_equal(list(model.p_corpus), list(streamed.p_corpus))
+    assert_equal(-np.inf, model.p_corpus[model.vocab["mat"]])
+
+
+def test_parsimonious_lm_update_loaded():
+    docs = [s.split() for s in ["the cat sat on the mat",
+                                "the dog sat on the log"]]
+    model = ParsimoniousLM(docs, w=.3)
+    tempdir = mkdtemp()
+    try:
+        model.save(os.path.join(tempdir, 'model'))
+        loaded = ParsimoniousLM.load(os.path.join(tempdir, 'model'))
+        # Only known terms, so cf is not reallocated before adding.
+        loaded.update([["the", "cat"]])
+        loaded.merge(ParsimoniousLM([["the", "dog"]], w=.3))
+        model.update([["the", "cat"], ["the", "dog"]])
+        assert_equal(list(model.cf), list(loaded.cf))
+        assert_equal(list(model.p_corpus), list(loaded.p_corpus))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_vector_cache():
+    rng = np.random.RandomState(0)
+    X = sp.csr_matrix(rng.rand(10, 20) > .8, dtype=float)
+    batches = [X * (i + 1) for i in range(5)]
+    # Room for two batches; the others are spilled to disk.
+    size = sum(a.nbytes for a in [batches[0].data, batches[0].indices,
+                                  batches[0].indptr])
+    cache = cluster._VectorCache(2 * size + 10)
+    try:
+        for X in batches:
+            cache.append(X)
+        cached = list(cache)
+        assert_equal(len(batches), len(cached))
+        for X, Y in zip(batches, cached):
+            assert_equal((X != Y).nnz, 0)
+        # Spilled batches are read back without copying.
+        assert_equal([False, False, True, True, True],
+                     [isinstance(b, tuple) for b in cache._batches])
+        assert_true(not cached[-1].data.flags.owndata)
+        tempdir = cache._dir
+    finally:
+        cache.close()
+    assert_true(not os.path.exists(tempdir))
+
+
+def test_big_kmeans_cache():
+    docs = ["apple pear banana fruit", "apple apple cherry banana",
+            "pear fruit banana pineapple", "beer pizza pizza beer",
+            "pizza pineapple coke", "beer coke sugar"]
+    fetch_batches = cluster.fetch_batches
+    fetched = []
+
+    def counting_fetch_batches(docs, batch_size):
+        fetched.append(1)
+        return fetch_batches(docs, batch_size)
+
+    cluster.fetch_batches = counting_fetch_batches
+    try:
+        clusters = big_kmeans(docs, 2, batch_size=2, single_pass=False,
+                              cache_memory=0)
+    finally:
+        cluster.fetch_batches = fetch_batches
+    assert_equal(len(fetched), 1)
+    assert_equal(sorted(docs), sorted(sum(map(list, clusters), [])))
@@ -16,13 +16,23 @@
 Test the CoreNLP parser/lemmatizer functions and task.
 """
 
+import os
 from os.path import dirname, join
+import shutil
+from tempfile import mkdtemp
+import time
 from unittest import SkipTest
 
-from nose.tools import assert_equal, assert_in
+from nose.tools import assert_equal, assert_in, assert_less, assert_raises
 
-from xtas.tasks._corenlp import parse, stanford_to_saf, get_corenlp_version
-from xtas.tasks.single import corenlp, corenlp_lemmatize
+from xtas._process import ProcessDied, process_pool
+from xtas.tests._stub import StubCommand
+
+from xtas.tasks import _corenlp
+from xtas.tasks._corenlp import (LEMMATIZE, _StanfordCoreNLP, _annotators,
+                                 _get_pool, _memory, parse, stanford_to_saf,
+                                 get_corenlp_version)
+from xtas.tasks.single import corenlp, corenlp_lemmatize, corenlp_many
 
 
 def _check_corenlp():
@@ -41,6 +51,21 @@ def test_parse_xml():
     assert_equal(london['pos'], 'NNP')
     assert_in({"type": "LOCATION", "tokens": [london['id']]}, saf['entities'])
 
+    tokens = {t['id']: t['word'] for t in saf['tokens']}
+    assert_equal(len(tokens), len(saf['tokens']))
+    deps = {(tokens[d['child']], d['relation'], tokens[d['parent']])
+            for d in saf['dependencies']}
+    assert_in(("John", "nsubj", "attacked"), deps)
+    assert_in(("London", "prep_in", "attacked"), deps)
+    assert_in(("back", "advmod", "hit"), deps)
+    assert_equal([[[tokens[t] for t in m] for m in coref]
+                  for coref in saf['coreferences']],
+                 [[["John"], ["him"]], [["me"], ["I"]]])
+    assert_equal([t['sentence'] for t in saf['trees']], [1, 2])
+    assert_equal(saf['trees'][1]['tree'],
+                 "(ROOT (S (NP (PRP I)) (VP (VBD hit) (NP (PRP him))"
+                 " (ADVP (RB back))) (. .)))")
+
 
 def test_lemmatize():
     _check_corenlp()
@@ -126,3 +151,169 @@ def test_task():
     assert_in('<dep type="nsubj">', raw)
     saf = corenlp("It works", output='saf')
     assert_equal(len(saf['dependencies']), 1)
+
+
+def test_task_many():
+    _check_corenlp()
+    docs = ["It works", "John loves himself", "Cool!"]
+    raw = corenlp_many(docs, output='raw')
+    assert_equal(raw, [corenlp(doc, output='raw') for doc in docs])
+    saf = corenlp_many(docs, output='saf')
+    assert_equal([len(s['tokens']) for s in saf], [2, 3, 2])
+
+
+def test_task_annotators():
+    _check_corenlp()
+    saf = corenlp("John lives in Amsterdam", output='saf',
+                  annotators="tokenize,ssplit,pos,lemma,ner")
+    assert_equal(set(saf.keys()), {'header', 'tokens', 'entities'})
+
+
+def test_annotators():
+    assert_equal(_annotators(None), None)
+    assert_equal(_annotators("tokenize, ssplit,pos,lemma"), LEMMATIZE)
+    assert_equal(_annotators(list(LEMMATIZE)), LEMMATIZE)
+    assert_equal(_memory(LEMMATIZE), "1G")
+    assert_equal(_memory(None), "3G")
+    assert_equal(_memory(LEMMATIZE + ('ner',)), "3G")
+
+
+def test_pool_memory():
+    corenlp_home = os.environ.get('CORENLP_HOME')
+    os.environ['CORENLP_HOME'] = tempdir = mkdtemp()
+    _StanfordCoreNLP.start = lambda self: None
+    pools = dict(_corenlp._pools)
+    _corenlp._pools.clear()
+    try:
+        with _get_pool(LEMMATIZE).checkout() as nlp:
+            assert_in(" -Xmx1G ", nlp.command())
+        with _get_pool(LEMMATIZE + ('ner',)).checkout() as nlp:
+            assert_in(" -Xmx3G ", nlp.command())
+    finally:
+        _corenlp._pools.clear()
+        _corenlp._pools.update(pools)
+        del _StanfordCoreNLP.start
+        shutil.rmtree(tempdir)
+        if corenlp_home is None:
+            del os.environ['CORENLP_HOME']
+        else:
+            os.environ['CORENLP_HOME'] = corenlp_home
+
+
+# Mimics CoreNLP's interactive mode: an XML document on stdout and a prompt
+# on stderr for every non-empty line of input, even if only whitespace.
+# Exits on "q".
+_STUB = r"""
+import sys
+sys.stderr.write("Loading models... done.\n\nNLP> ")
+sys.stderr.flush()
+for line in iter(sys.stdin.readline, ""):
+    line = line.rstrip("\n")
+    if line.strip() == "die":
+        sys.exit(3)
+    if line.lower() == "q":
+        break
+    if line:
+        sys.stdout.write("<?xml version='1.0'?>\n<root>\n<document>"
+                         + line.strip() + "</document>\n</root>\n")
+        sys.stdout.flush()
+    sys.stderr.write("NLP> ")
+    sys.stderr.flush()
+"""
+
+
+class _StubCoreNLP(StubCommand, _StanfordCoreNLP):
+    stub = _STUB
+
+
+def test_communicate():
+    nlp = _StubCoreNLP()
+    try:
+        t0 = time.time()
+        for i in range(10):
+            xml = nlp.parse(u"Sentence\n number  %d" % i)
+            assert_equal(xml, "<?xml version='1.0'?>\n<root>\n<document>"
+                              "Sentence number %d</document>\n</root>\n"
+                         % i)
+        # No more sleeping 100 ms per document.
+        assert_less(time.time() - t0, 1.)
+    finally:
+        nlp.close()
+
+
+def test_communicate_respawn():
+    nlp = _StubCoreNLP()
+    try:
+        assert_raises(ProcessDied, nlp.parse, "die")
+        assert_in("</root>", nlp.parse("Alive again"))
+    finally:
+        nlp.close()
+
+
+def test_communicate_many():
+    nlp = _StubCoreNLP()
+    try:
+        texts = [u"Doc %d " % i + u"word " * 50 for i in range(2000)]
+        texts[10] = " \n"
+        texts[11] = "q"
+        texts[12] = u"\tQ "
+        results = nlp.parse_many(texts)
+        assert_equal(len(results), len(texts))
+        assert_equal(results[10:13], ['', '', ''])
+        for i in [0, 13, 1999]:
+            assert_equal(results[i], nlp.parse(texts[i]))
+        assert_equal(nlp.parse_many(["q", ""]), ['', ''])
+
+        # Whitespace gets a document; later results must not shift.
+        results = nlp.request([" \n", "after\n"])
+        assert_in("<document></document>", results[0])
+        assert_in("<document>after</document>", results[1])
+    finally:
+        nlp.close()
+
+
+# Answers every non-empty line with CoreNLP XML for its words, as tokens of
+# a single sentence.
+_TOKENS_STUB = r"""
+import sys
+sys.stderr.write("NLP> ")
+sys.stderr.flush()
+for line in iter(sys.stdin.readline, ""):
+    line = line.rstrip("\n")
+    if line.lower() == "q":
+        break
+    if line:
+        tokens = "".join('<token id="%d"><word>%s</word><lemma>%s</lemma>'
+                         '<POS>NN</POS></token>' % (i, w, w.lower())
+                         for i, w in enumerate(line.split(), 1))
+        sys.stdout.write("<?xml version='1.0'?>\n<root><document><sentences>"
+                         '<sentence id="1"><tokens>' + tokens +
+                         "</tokens></sentence></sentences></document>"
+                         "</root>\n")
+        sys.stdout.flush()
+    sys.stderr.write("NLP> ")
+    sys.stderr.flush()
+"""
+
+
+class _TokensStubCoreNLP(StubCommand, _StanfordCoreNLP):
+    stub = _TOKENS_STUB
+
+
+def test_corenlp_many_empty():
+    pools = dict(_corenlp._pools)
+    _corenlp._pools.clear()
+    _corenlp._pools[None] = pool = process_pool(_TokensStubCoreNLP,
+                                                'corenlp')
+    try:
+        empty, quit, saf = corenlp_many([u"", u"q", u"Een zin."],
+                                         output='saf')
+        assert_equal(empty['tokens'], [])
+        assert_equal(quit['tokens'], [])
+        assert_in('header', empty)
+        assert_equal([t['lemma'] for t in saf['tokens']],
+                     ['een', 'zin.'])
+    finally:
+        pool.close()
+        _corenlp._pools.clear()
+        _corenlp._pools.update(pools)
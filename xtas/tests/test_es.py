@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from nose.tools import assert_equal, assert_in
+from nose.tools import assert_equal, assert_in, assert_raises
 from unittest import SkipTest
 import logging
 from contextlib import contextmanager
@@ -68,6 +68,37 @@ def test_fetch():
         assert_equal(fetch(doc), "test")
 
 
+def test_fetch_many():
+    from xtas.tasks.es import fetch_many, es_document
+    assert_equal(fetch_many(["a", u"b"]), ["a", u"b"])
+    with clean_es() as es:
+        ids = [es.index(index=ES_TEST_INDEX, doc_type=ES_TEST_TYPE,
+                        body={"text": "test%d" % i})['_id']
+               for i in range(3)]
+        docs = [es_document(ES_TEST_INDEX, ES_TEST_TYPE, id, "text")
+                for id in ids]
+        assert_equal(fetch_many([docs[2], "literal", docs[0]]),
+                     ["test2", "literal", "test0"])
+
+
+def test_fetch_batches():
+    from xtas.tasks.es import fetch_batches
+    docs = [u"doc %d" % i for i in range(10)]
+    assert_equal(list(fetch_batches(docs, 3)),
+                 [docs[:3], docs[3:6], docs[6:9], docs[9:]])
+
+    # Consumer stops early.
+    batches = fetch_batches(iter(docs), 1, prefetch=1)
+    assert_equal(next(batches), docs[:1])
+    batches.close()
+
+    # Errors are raised in the consumer.
+    batches = fetch_batches(docs[:4] + [None], 2)
+    assert_equal(next(batches), docs[:2])
+    assert_equal(next(batches), docs[2:4])
+    assert_raises(TypeError, next, batches)
+
+
 def test_query_batch():
     "Test getting multiple documents in a batch"
     from xtas.tasks.es import fetch_query_batch
@@ -18,12 +18,17 @@ Test the Frog lemmatizer functions and task.
 
 import logging
 import socket
+import SocketServer
+import threading
+import time
 from unittest import SkipTest
 
-from nose.tools import assert_equal
+from nose.tools import (assert_equal, assert_greater, assert_less_equal,
+                        assert_raises)
 
-from xtas.tasks._frog import (_FROG_HOST, _FROG_PORT, call_frog, frog_to_saf,
-                              parse_frog)
+from xtas._process import ProcessTimeout
+from xtas.tasks._frog import (_FROG_HOST, _FROG_PORT, FrogClient, call_frog,
+                              frog_to_saf, parse_frog)
 
 
 def _check_frog():
@@ -95,3 +100,155 @@ def test_frog_task():
     saf = frog("dit is een test", output='saf')
     assert_equal(len(saf['tokens']), 4)
     assert_equal(saf['header']['processed'][0]['module'], 'frog')
+
+
+class _StubFrogHandler(SocketServer.StreamRequestHandler):
+    """Mimics a Frog server: answers every EOT-terminated document with
+    LINES and READY."""
+
+    def handle(self):
+        try:
+            self._handle()
+        except socket.error:
+            pass    # Client went away.
+
+    def _handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        doc = []
+        for line in iter(self.rfile.readline, ''):
+            if line.strip() != "EOT":
+                doc.append(line)
+                continue
+            with server.lock:
+                server.documents.append(''.join(doc))
+                server.active += 1
+                server.max_active = max(server.active, server.max_active)
+            doc = []
+            time.sleep(server.delay)
+            with server.lock:
+                server.active -= 1
+            for out in LINES:
+                self.wfile.write(out + "\n")
+            self.wfile.write("READY\n")
+            self.wfile.flush()
+            if self.server.one_shot:
+                return
+
+
+class _StubFrogServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, one_shot=False, delay=0):
+        SocketServer.ThreadingTCPServer.__init__(self, ('localhost', 0),
+                                                 _StubFrogHandler)
+        self.connections = 0
+        self.documents = []
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+        self.one_shot = one_shot
+        self.delay = delay
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _run_threads(client, n_threads, n_docs):
+    results = []
+
+    def work():
+        for _ in range(n_docs):
+            results.append(client.process("zin"))
+
+    threads = [threading.Thread(target=work) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_client_reuses_connections():
+    server = _StubFrogServer()
+    client = FrogClient(hosts=[server.server_address])
+    try:
+        for _ in range(5):
+            assert_equal(client.process(u"dit is in Amsterdam."), LINES)
+        assert_equal(server.connections, 1)
+        assert_equal(server.documents, ["dit is in Amsterdam.\n"] * 5)
+    finally:
+        client.close()
+        server.close()
+
+
+def test_client_reconnects():
+    server = _StubFrogServer(one_shot=True)
+    client = FrogClient(hosts=[server.server_address], max_inflight=1)
+    try:
+        for _ in range(3):
+            assert_equal(client.process("Tweede zin!\n"), LINES)
+        assert_equal(server.connections, 3)
+    finally:
+        client.close()
+        server.close()
+
+
+def test_client_balancing():
+    servers = [_StubFrogServer(delay=.01), _StubFrogServer(delay=.01)]
+    client = FrogClient(hosts=[s.server_address for s in servers],
+                        max_inflight=2)
+    try:
+        results = _run_threads(client, n_threads=6, n_docs=5)
+
+        assert_equal(results, [LINES] * 30)
+        for s in servers:
+            assert_greater(len(s.documents), 0)
+            assert_less_equal(s.max_active, 2)
+            assert_less_equal(s.connections, 2)
+        assert_equal(sum(len(s.documents) for s in servers), 30)
+    finally:
+        client.close()
+        for s in servers:
+            s.close()
+
+
+def test_client_ejects_dead_server():
+    # Find a port that nobody listens on.
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    dead = s.getsockname()
+    s.close()
+
+    server = _StubFrogServer()
+    client = FrogClient(hosts=[dead, server.server_address], eject_time=60)
+    try:
+        results = _run_threads(client, n_threads=3, n_docs=5)
+        assert_equal(results, [LINES] * 15)
+        assert_equal(len(server.documents), 15)
+        dead_endpoint = client.endpoints[0]
+        assert_equal(dead_endpoint.address, dead)
+        assert_greater(dead_endpoint.dead_until, time.time())
+    finally:
+        client.close()
+        server.close()
+
+
+def test_client_timeout():
+    server = _StubFrogServer(delay=1)
+    client = FrogClient(hosts=[server.server_address], timeout=.2)
+    try:
+        assert_raises(ProcessTimeout, client.process, "trage zin")
+        endpoint, = client.endpoints
+        assert_equal(endpoint.dead_until, 0)
+        assert_equal(endpoint.inflight, 0)
+
+        server.delay = 0
+        assert_equal(client.process("snelle zin"), LINES)
+    finally:
+        client.close()
+        server.close()
@@ -7,8 +7,12 @@ import xml.etree.ElementTree as etree
 from nose import SkipTest
 from nose.tools import assert_equal, assert_false, assert_raises
 
+from xtas._process import ProcessDied, process_pool
 from xtas.tasks import heideltime
-from xtas.tasks._heideltime import _set_treetagger_home
+from xtas.tasks import _heideltime
+from xtas.tasks._heideltime import (_HeidelTimeServer, _set_treetagger_home,
+                                    call_heideltime_many)
+from xtas.tests._stub import StubCommand
 
 
 def test_set_treetagger_home():
@@ -34,6 +38,27 @@ def test_set_treetagger_home():
         pass
 
 
+def test_compile_server():
+    if path.exists(path.join(path.dirname(_heideltime.__file__),
+                             'HeidelTimeServer.class')):
+        raise SkipTest("HeidelTimeServer.class shipped with xtas")
+    directory = mkdtemp(prefix='xtas-heideltime-test.')
+    search_path = os.environ['PATH']
+    try:
+        # No javac on the PATH.
+        os.environ['PATH'] = directory
+        assert_raises(RuntimeError, _heideltime._compile_server,
+                      'heideltime.jar', directory)
+
+        # Precompiled class in the Heideltime directory.
+        open(path.join(directory, 'HeidelTimeServer.class'), 'w').close()
+        assert_equal(directory,
+                     _heideltime._compile_server('heideltime.jar', directory))
+    finally:
+        os.environ['PATH'] = search_path
+        rmtree(directory)
+
+
 def test_heideltime():
     raise SkipTest("Heideltime needs TreeTagger installed")
 
@@ -53,3 +78,69 @@ def test_heideltime():
     assert_equal(list(time.keys()), ['tid', 'type', 'value'])
     assert_equal(time['type'], 'DURATION')
     assert_equal(time['value'], 'P12H')
+
+
+# Speaks the HeidelTimeServer protocol; tags "today" as a date and logs
+# its starts to stderr.
+_STUB = r"""
+import re, sys
+sys.stderr.write("started\n")
+while True:
+    header = sys.stdin.readline()
+    if not header:
+        break
+    language, length = header.split()
+    doc = sys.stdin.read(int(length))
+    if doc == "die":
+        sys.exit(1)
+    if language == "klingon":
+        sys.stdout.write("-1\nUnknown language\n")
+        sys.stdout.flush()
+        continue
+    doc = re.sub("today", '<TIMEX3 tid="t1" type="DATE" value="%s">today'
+                          '</TIMEX3>' % language, doc)
+    out = "<TimeML>%s</TimeML>" % doc
+    sys.stdout.write("%d\n%s" % (len(out), out))
+    sys.stdout.flush()
+"""
+
+
+class _StubServer(StubCommand, _HeidelTimeServer):
+    stub = _STUB
+
+
+def test_server():
+    server = _StubServer()
+    try:
+        doc = u"Today & today, caf\xe9\nand tomorrow."
+        for language in ["english", "dutch"]:
+            out = server.process_doc(doc, language)
+            assert_equal(out.decode('utf-8'),
+                         u'<TimeML>Today & <TIMEX3 tid="t1" type="DATE" '
+                         u'value="%s">today</TIMEX3>, caf\xe9\n'
+                         u'and tomorrow.</TimeML>' % language)
+        process = server.process
+
+        assert_raises(ValueError, server.process_doc, "", "klingon")
+        assert_equal(server.process_doc("", "english"), "<TimeML></TimeML>")
+        assert_raises(ProcessDied, server.process_doc, "die", "english")
+        assert_equal(server.process_doc("today", "english"),
+                     '<TimeML><TIMEX3 tid="t1" type="DATE" value="english">'
+                     'today</TIMEX3></TimeML>')
+        assert process is not server.process
+    finally:
+        server.close()
+
+
+def test_heideltime_many():
+    old_pool = _heideltime._pool
+    _heideltime._pool = process_pool(_StubServer, 'heideltime')
+    try:
+        docs = ["today & today", "nothing", u"caf\xe9 today"]
+        assert_equal(call_heideltime_many(docs, "english", "values"),
+                     [["english", "english"], [], ["english"]])
+        assert_equal(call_heideltime_many(docs[:1], "dutch", "dicts"),
+                     [[{'tid': 't1', 'type': 'DATE', 'value': 'dutch'}] * 2])
+    finally:
+        _heideltime._pool.close()
+        _heideltime._pool = old_pool
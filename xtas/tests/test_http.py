@@ -0,0 +1,286 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the shared HTTP connections and cache, and the entity linking tasks
+that use them, against a stub web service.
+"""
+
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+from urlparse import parse_qs, urlparse
+
+from nose.tools import assert_equal, assert_less, assert_raises
+
+from xtas import _http
+from xtas._http import HTTPError, LRUCache, call_service, form_request
+from xtas.tasks import (dbpedia_spotlight, dbpedia_spotlight_many,
+                        semanticize, semanticize_many, semanticizest)
+
+
+_SPOTLIGHT = {"annotation": {"@text": "Amsterdam", "surfaceForm": {
+    "@name": "Amsterdam", "@offset": "0",
+    "resource": {"@label": "Amsterdam", "@uri": "Amsterdam",
+                 "@contextualScore": "0.9", "@support": "1234"}}}}
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers like the entity linking services, logging all requests."""
+
+    protocol_version = "HTTP/1.1"       # Keep-alive.
+
+    def do_GET(self):
+        self._answer(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Type') == 'application/json':
+            self._answer(json.loads(body))
+        else:
+            self._answer(parse_qs(body))
+
+    def _answer(self, args):
+        server = self.server
+        path = urlparse(self.path).path
+        with server.lock:
+            server.requests.append((self.command, path, args))
+            server.active += 1
+            server.max_active = max(server.active, server.max_active)
+            failing = server.failures > 0
+            server.failures -= failing
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self._send(503, "")
+            else:
+                self._route(path, args)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _route(self, path, args):
+        if path.startswith("/api/"):
+            text = args['text'][0].decode('utf-8')
+            out = {"links": [{"label": text.split()[0]}]}
+        elif path == "/all":
+            out = [{"target": args.split()[0]}]
+        elif path == "/rest/candidates":
+            out = _SPOTLIGHT
+        else:
+            self._send(404, "")
+            return
+        self._send(200, json.dumps(out))
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0),
+                                           _StubHandler)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.active = self.max_active = 0
+        self.delay = 0      # Seconds to wait before answering.
+        self.failures = 0   # Number of requests to answer with 503.
+        self.url = "http://localhost:%d" % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Stub(object):
+    def __enter__(self):
+        _http._cache.clear()
+        self.server = _StubServer()
+        return self.server
+
+    def __exit__(self, *exc_info):
+        _http._http.clear()     # Close kept-alive connections.
+        self.server.close()
+        _http._cache.clear()
+
+
+def test_form_request():
+    with _Stub() as server:
+        url = server.url + "/api/en"
+        short = json.loads(form_request(url, {'text': u"caf\xe9 au lait"}))
+        assert_equal(short, {"links": [{"label": u"caf\xe9"}]})
+        long_text = u"lait " * 1000
+        json.loads(form_request(url, {'text': long_text}))
+        assert_equal([r[0] for r in server.requests], ["GET", "POST"])
+        assert_equal(server.requests[1][2], {'text': [long_text.encode()]})
+
+        assert_raises(HTTPError, form_request, server.url + "/nothing", {})
+
+
+def test_cache():
+    with _Stub():
+        calls = []
+
+        def send():
+            calls.append(1)
+            return '{"x": 1}'
+
+        text = u"t\xebxt"
+        out = call_service('service', 'en', text, {'p': 1}, send)
+        out['x'] = 2    # Must not affect the cache.
+        assert_equal(call_service('service', 'en', text, {'p': 1}, send),
+                     {"x": 1})
+        assert_equal(len(calls), 1)
+        call_service('service', 'en', text, {'p': 2}, send)
+        call_service('service', 'nl', text, {'p': 1}, send)
+        call_service('service', 'en', u"text", {'p': 1}, send)
+        assert_equal(len(calls), 4)
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    cache.get(1)
+    cache.put(3, 'c')
+    assert_equal((cache.get(1), cache.get(2), cache.get(3)),
+                 ('a', None, 'c'))
+    assert_equal(len(cache), 2)
+
+
+def test_semanticize():
+    with _Stub() as server:
+        api = server.url + "/api"
+        for _ in range(3):
+            assert_equal(semanticize("Amsterdam is great", api_url=api),
+                         [{"label": "Amsterdam"}])
+        assert_equal(semanticize("Amsterdam is great", lang='nl',
+                                 api_url=api),
+                     [{"label": "Amsterdam"}])
+        assert_equal(semanticize("Utrecht too", api_url=api),
+                     [{"label": "Utrecht"}])
+        assert_equal([r[1] for r in server.requests],
+                     ["/api/en", "/api/nl", "/api/en"])
+
+
+def test_semanticizest():
+    with _Stub() as server:
+        for _ in range(2):
+            assert_equal(semanticizest("Amsterdam is great", server.url),
+                         [{"target": "Amsterdam"}])
+        assert_equal(server.requests,
+                     [("POST", "/all", "Amsterdam is great")])
+
+
+def test_dbpedia_spotlight():
+    with _Stub() as server:
+        api = server.url + "/rest"
+        for _ in range(2):
+            out = dbpedia_spotlight("Amsterdam", api_url=api)
+            assert_equal(out, [{"name": "Amsterdam", "offset": 0,
+                                "resource": [{"label": "Amsterdam",
+                                              "uri": "Amsterdam",
+                                              "contextualScore": 0.9,
+                                              "support": 1234}]}])
+        assert_equal(len(server.requests), 1)
+        method, path, args = server.requests[0]
+        assert_equal((method, path), ("POST", "/rest/candidates"))
+        assert_equal(args['confidence'], ['0.5'])
+
+        dbpedia_spotlight("Amsterdam", api_url=api, conf=.7)
+        assert_equal(len(server.requests), 2)
+
+
+def test_keep_alive():
+    with _Stub() as server:
+        connections = []
+        setup = _StubHandler.setup
+
+        def counting_setup(handler):
+            connections.append(1)
+            setup(handler)
+
+        _StubHandler.setup = counting_setup
+        try:
+            for i in range(5):
+                form_request(server.url + "/api/en", {'text': "doc %d" % i})
+        finally:
+            _StubHandler.setup = setup
+        assert_equal(len(server.requests), 5)
+        assert_equal(len(connections), 1)
+
+
+def test_semanticize_many():
+    with _Stub() as server:
+        server.delay = .2
+        api = server.url + "/api"
+        docs = ["doc%d is here" % i for i in range(20)]
+        t0 = time.time()
+        out = semanticize_many(docs, api_url=api)
+        assert_equal(out, [[{"label": "doc%d" % i}] for i in range(20)])
+        # Concurrent, but no more than the cap at a time.
+        assert_less(time.time() - t0, 20 * server.delay / 2)
+        assert_equal(len(server.requests), 20)
+        assert_less(1, server.max_active)
+        assert_less(server.max_active, _http._MAX_CONCURRENT + 1)
+
+
+def test_dbpedia_spotlight_many():
+    with _Stub() as server:
+        api = server.url + "/rest"
+        out = dbpedia_spotlight_many(["Amsterdam", "Amsterdam!"],
+                                     api_url=api)
+        assert_equal(len(out), 2)
+        assert_equal(out[0], dbpedia_spotlight("Amsterdam", api_url=api))
+        assert_equal(len(server.requests), 2)
+
+
+def test_retries():
+    backoff = _http._BACKOFF
+    _http._BACKOFF = .01
+    try:
+        with _Stub() as server:
+            server.failures = 2
+            url = server.url + "/api/en"
+            send = lambda: form_request(url, {'text': "retry me"})
+            assert_equal(call_service('service', 'en', "retry me", {}, send),
+                         {"links": [{"label": "retry"}]})
+            assert_equal(len(server.requests), 3)
+
+            server.failures = _http._RETRIES + 1
+            assert_raises(HTTPError, call_service, 'service', 'en', "again",
+                          {}, send)
+
+            # Client errors are not retried.
+            del server.requests[:]
+            send = lambda: form_request(server.url + "/nothing", {})
+            assert_raises(HTTPError, call_service, 'service', 'en', "404",
+                          {}, send)
+            assert_equal(len(server.requests), 1)
+    finally:
+        _http._BACKOFF = backoff
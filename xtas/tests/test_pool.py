@@ -0,0 +1,107 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+
+from nose.tools import assert_equal, assert_less_equal, assert_raises
+
+from xtas._pool import Pool, parse_memory, pool_size
+
+
+class _Resource(object):
+    ids = itertools.count()
+
+    def __init__(self):
+        self.id = next(self.ids)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_reuse():
+    pool = Pool(_Resource, size=2)
+    with pool.checkout() as a:
+        pass
+    with pool.checkout() as b:
+        assert_equal(a.id, b.id)
+        with pool.checkout() as c:
+            assert_equal(c.id, a.id + 1)
+    pool.close()
+    assert_equal((a.closed, c.closed), (True, True))
+
+
+def test_pool_bounded():
+    pool = Pool(_Resource, size=3)
+    lock = threading.Lock()
+    active = set()
+    max_active = [0]
+    seen = set()
+
+    def work():
+        for _ in range(20):
+            with pool.checkout() as r:
+                with lock:
+                    assert r.id not in active
+                    active.add(r.id)
+                    seen.add(r.id)
+                    max_active[0] = max(max_active[0], len(active))
+                time.sleep(.001)
+                with lock:
+                    active.remove(r.id)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert_less_equal(max_active[0], 3)
+    # Objects are created lazily, so how many depends on scheduling.
+    assert_less_equal(len(seen), 3)
+
+
+def test_pool_factory_failure():
+    def fail():
+        raise IOError("cannot start")
+
+    pool = Pool(fail, size=1)
+    for _ in range(2):  # Failure shouldn't use up the only slot.
+        with assert_raises(IOError):
+            with pool.checkout():
+                pass
+
+
+def test_pool_idle_timeout():
+    pool = Pool(_Resource, size=1, idle_timeout=.05)
+    with pool.checkout() as a:
+        pass
+    time.sleep(.2)
+    assert_equal(a.closed, True)
+    with pool.checkout() as b:
+        assert_equal(b.closed, False)
+        assert_equal(b.id, a.id + 1)
+
+
+def test_pool_size():
+    assert_equal(parse_memory("3G"), 3 * 2 ** 30)
+    assert_equal(parse_memory("512m"), 512 * 2 ** 20)
+    assert_raises(ValueError, parse_memory, "lots")
+
+    assert_equal(pool_size(), 1)
+    assert_equal(pool_size("2"), 2)
+    assert_equal(pool_size(None, "12G", "3G"), 4)
+    assert_equal(pool_size(None, "2G", "3G"), 1)
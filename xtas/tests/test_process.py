@@ -0,0 +1,155 @@
+# Copyright 2013-2015 Netherlands eScience Center and University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the managed external process framework.
+"""
+
+import os
+import sys
+import time
+
+from nose.tools import assert_equal, assert_less, assert_raises, assert_true
+
+from xtas._process import (ManagedProcess, ProcessDied, ProcessTimeout,
+                           metrics, process_pool)
+
+
+# Echoes lines in upper case; "sleep" hangs, "die" exits.
+_ECHO = r"""
+import sys, time
+for line in iter(sys.stdin.readline, ""):
+    if line.strip() == "sleep":
+        time.sleep(60)
+    if line.strip() == "die":
+        sys.stderr.write("dying\n")
+        sys.exit(2)
+    sys.stdout.write(line.upper())
+    sys.stdout.flush()
+"""
+
+
+class _Echo(ManagedProcess):
+    name = "echo"
+
+    def command(self):
+        return [sys.executable, '-u', '-c', _ECHO]
+
+    def size(self, lines):
+        return len(lines)
+
+    def communicate(self, lines):
+        out = []
+        self.exchange_lines(''.join(l + "\n" for l in lines),
+                            lambda: len(out) == len(lines), out.append)
+        return out
+
+
+def test_request():
+    echo = _Echo()
+    try:
+        lines = ["line %d" % i for i in range(10000)]
+        assert_equal(echo.request(lines), [l.upper() for l in lines])
+    finally:
+        echo.close()
+
+
+def test_restart():
+    echo = _Echo()
+    try:
+        process = echo.process
+        assert_raises(ProcessDied, echo.request, ["die"])
+        assert_equal(echo.request(["alive"]), ["ALIVE"])
+        assert_true(echo.process is not process)
+
+        # Killed between requests.
+        process = echo.process
+        process.kill()
+        process.wait()
+        assert_equal(echo.request(["alive"]), ["ALIVE"])
+        assert_true(echo.process is not process)
+    finally:
+        echo.close()
+
+
+def test_max_requests():
+    echo = _Echo(max_requests=3)
+    try:
+        pids = set()
+        for i in range(7):
+            echo.request(["x"])
+            pids.add(echo.process.pid)
+        assert_equal(len(pids), 3)
+    finally:
+        echo.close()
+
+
+def test_timeout():
+    echo = _Echo(timeout=.5)
+    try:
+        t0 = time.time()
+        assert_raises(ProcessTimeout, echo.request, ["sleep"])
+        assert_less(time.time() - t0, 5)
+        assert_equal(echo.request(["awake"]), ["AWAKE"])
+
+        # The timeout is per document.
+        lines = ["line %d" % i for i in range(3)]
+        assert_equal(echo.request(lines), [l.upper() for l in lines])
+    finally:
+        echo.close()
+
+
+class _SlowStart(_Echo):
+    def handshake(self):
+        self.communicate(["sleep"])
+
+
+def test_start_timeout():
+    assert_raises(ProcessTimeout, _SlowStart, start_timeout=.5)
+
+
+def test_metrics():
+    before = metrics().get("echo", {})
+    echo = _Echo()
+    try:
+        echo.request(["a"])
+        echo.request(["b"])
+    finally:
+        echo.close()
+    after = metrics()["echo"]
+    assert_equal(after["started"] - before.get("started", 0), 1)
+    assert_equal(after["requests"] - before.get("requests", 0), 2)
+    assert_true(after["seconds"] > before.get("seconds", 0))
+
+
+def test_process_pool():
+    os.environ['XTAS_ECHO_POOL_SIZE'] = '2'
+    os.environ['XTAS_ECHO_MAX_REQUESTS'] = '5'
+    os.environ['XTAS_ECHO_TIMEOUT'] = '2.5'
+    try:
+        pool = process_pool(_Echo, 'echo')
+    finally:
+        del os.environ['XTAS_ECHO_POOL_SIZE']
+        del os.environ['XTAS_ECHO_MAX_REQUESTS']
+        del os.environ['XTAS_ECHO_TIMEOUT']
+    assert_equal(pool.size, 2)
+    try:
+        with pool.checkout() as echo:
+            assert_equal(echo.max_requests, 5)
+            assert_equal(echo.timeout, 2.5)
+            assert_equal(echo.request(["pooled"]), ["POOLED"])
+    finally:
+        pool.close()
+
+    assert_equal(process_pool(_Echo, 'echo', memory="4G").size, 1)
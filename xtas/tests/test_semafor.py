@@ -23,7 +23,9 @@ CoreNLP installation dir.
 import os
 from unittest import SkipTest
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises
+
+from xtas.tests._stub import StubCommand
 
 
 def _check_corenlp_home():
@@ -50,6 +52,90 @@ def test_to_conll():
     assert_equal(deps, TEST_CONLL)
 
 
+def test_to_conll_many():
+    from xtas.tasks._semafor import to_conll_many
+    _check_corenlp_home()
+
+    other = "(ROOT (S (NP (NNP Mary)) (VP (VBZ sleeps))))"
+    result = to_conll_many([TEST_TREE, other, TEST_TREE])
+
+    assert_equal(len(result), 3)
+    assert_equal([x for x in result[0].split("\n") if x.strip()], TEST_CONLL)
+    assert_equal(result[0], result[2])
+    assert_equal(len([x for x in result[1].split("\n") if x.strip()]), 2)
+
+
+def test_split_conll():
+    from xtas.tasks._semafor import _split_conll
+
+    conll = "\n".join(TEST_CONLL) + "\n"
+    out = "{0}\n{0}\n".format(conll)
+    assert_equal(_split_conll(out, 2), [conll, conll])
+    assert_raises(ValueError, _split_conll, out, 3)
+
+
+# Speaks the SemaforInteractive protocol, returning the words of each
+# sentence and no frames. Exits on the word "die".
+_STUB = r"""
+import json, sys
+print(">>>")
+sys.stdout.flush()
+words = []
+for line in iter(sys.stdin.readline, ""):
+    if line.strip():
+        words.append(line.split("\t")[1])
+        continue
+    if "die" in words:
+        sys.exit(1)
+    print(json.dumps({"frames": [], "tokens": words}))
+    print(">>>")
+    sys.stdout.flush()
+    words = []
+"""
+
+
+def _stub_semafor():
+    from xtas.tasks._semafor import _Semafor
+
+    class StubSemafor(StubCommand, _Semafor):
+        stub = _STUB
+
+    return StubSemafor()
+
+
+def _conll(*words):
+    return "".join("{}\t{}\t_\tNN\tNN\t_\t0\troot\t_\t_\n".format(i, w)
+                   for i, w in enumerate(words, 1))
+
+
+def test_semafor_pipeline():
+    semafor = _stub_semafor()
+    try:
+        # Enough sentences to fill the pipes if we didn't write and read
+        # concurrently.
+        conlls = [_conll("sentence", str(i)) for i in range(5000)]
+        results = semafor.call_semafor_many(conlls)
+        assert_equal([r['tokens'] for r in results],
+                     [["sentence", str(i)] for i in range(5000)])
+        assert_equal(semafor.call_semafor(_conll("John", "loves"))['tokens'],
+                     ["John", "loves"])
+    finally:
+        semafor.close()
+
+
+def test_semafor_respawn():
+    from xtas._process import ProcessDied
+    semafor = _stub_semafor()
+    try:
+        process = semafor.process
+        assert_raises(ProcessDied, semafor.call_semafor, _conll("die"))
+        assert_equal(semafor.call_semafor(_conll("alive"))['tokens'],
+                     ["alive"])
+        assert process is not semafor.process
+    finally:
+        semafor.close()
+
+
 def test_semafor():
     "Test raw semafor output"
     from xtas.tasks._semafor import call_semafor
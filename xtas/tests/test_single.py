@@ -19,7 +19,8 @@ from nose.tools import (assert_equal, assert_greater, assert_in, assert_less,
 
 from xtas.tasks import (dbpedia_spotlight, guess_language, morphy,
                         movie_review_emotions, movie_review_polarity,
-                        nlner_conll, stem_snowball, sentiwords_tag, tokenize)
+                        nlner_conll, pos_tag, pos_tag_many, stem_snowball,
+                        sentiwords_tag, tokenize)
 
 
 def test_langid():
@@ -76,6 +77,15 @@ def test_tokenize():
     assert_equal(tokens, expected)
 
 
+def test_pos_tag_many():
+    sentences = ["My hovercraft is full of eels.",
+                 "Cats are furry.".split()]
+    expected = [pos_tag(tokenize(sentences[0])), pos_tag(sentences[1])]
+    assert_equal(pos_tag_many(sentences), expected)
+    assert_equal(pos_tag_many(sentences * 3, n_jobs=2, batch_size=2),
+                 expected * 3)
+
+
 def test_dbpedia_spotlight():
     en_text = (u"Will the efforts of artists like Moby"
                u" help to preserve the Arctic?")
@@ -14,9 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from nose.tools import assert_in, assert_true
+from nose.tools import assert_equal, assert_in, assert_raises, assert_true
 
-from xtas.tasks import stanford_ner_tag
+from xtas._process import ProcessDied
+from xtas.tasks import stanford_ner_tag, stanford_ner_tag_many
+from xtas.tasks._stanford_ner import _NERServer
+from xtas.tests._stub import StubCommand
 
 
 def test_stanford_ner():
@@ -41,3 +44,43 @@ def test_stanford_ner_encoding():
     # but detected in the context of Stanford NER, so a non-regression test.
     stanford_ner_tag('\xe9toile'.decode('latin-1'))
     stanford_ner_tag('\xe9toile')
+
+
+def test_stanford_ner_many():
+    docs = ["Benjamin Franklin Tilley was an officer.", "Nothing here.",
+            "He was governor of American Samoa."]
+    tagged = stanford_ner_tag_many(docs, output="names")
+    assert_equal(tagged, [stanford_ner_tag(doc, output="names")
+                          for doc in docs])
+
+
+# Speaks the NERServer protocol, tagging capitalized words as PERSON.
+_STUB = r"""
+import sys
+for line in iter(sys.stdin.readline, ""):
+    if line.strip() == "die":
+        sys.exit(1)
+    sys.stdout.write(" ".join(w + ("/PERSON" if w.istitle() else "/O")
+                              for w in line.split()) + "\n")
+    sys.stdout.flush()
+"""
+
+
+class _StubServer(StubCommand, _NERServer):
+    stub = _STUB
+
+
+def test_ner_server():
+    server = _StubServer()
+    try:
+        lines = ["Line %d by John" % i for i in range(5000)]
+        out = server.tag_lines(lines)
+        assert_equal(out, ["Line/PERSON %d/O by/O John/PERSON" % i
+                           for i in range(5000)])
+
+        process = server.process
+        assert_raises(ProcessDied, server.tag_lines, ["die"])
+        assert_equal(server.tag_lines(["Mary"]), ["Mary/PERSON"])
+        assert_true(process is not server.process)
+    finally:
+        server.close()